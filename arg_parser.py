@@ -1,12 +1,17 @@
 import argparse
-import magic
 import sys
+from logo_cache import LogoCache, LogoNotFoundError
+from output_profile import OutputProfile
 from pathlib import Path
+from profiler import Profiler
 
 
 class ArgParser:
     def __init__(self):
-        self.parser = argparse.ArgumentParser()
+        self.parser = argparse.ArgumentParser(
+            epilog="run 'project.py serve -h' to render invoices over http"
+        )
+        self.parser.set_defaults(command=None)
         self.parser.add_argument(
             "-l",
             "--logo",
@@ -17,34 +22,301 @@ class ArgParser:
             "-d",
             "--details",
             metavar="details_file",
-            required=True,
             help="path to json file with invoice details",
         )
         self.parser.add_argument(
             "-i",
             "--items",
             metavar="items_file",
-            required=True,
-            help="path to csv file with invoice items",
+            help="path to csv file with invoice items (with -m, a master items file"
+            " from which jobs naming no items file get those of their period)",
+        )
+        self.parser.add_argument(
+            "-o",
+            "--output",
+            metavar="pdf_file",
+            help="path to write the invoice to, or - for stdout"
+            " (default: invoice-<number>.pdf)",
+        )
+        self.parser.add_argument(
+            "--output-profile",
+            choices=OutputProfile.NAMES,
+            help="trade CPU time for output size: 'fast' for previews, 'small'"
+            " for archival (default: balanced)",
+        )
+        self.parser.add_argument(
+            "--spool-pages",
+            action="store_true",
+            help="write each finished page to a temporary file instead of keeping"
+            " it in memory, for invoices running to thousands of pages",
+        )
+        self.parser.add_argument(
+            "-m",
+            "--manifest",
+            metavar="manifest_file",
+            help="path to json lines file listing the invoices to render in batch",
+        )
+        self.parser.add_argument(
+            "--pipeline",
+            action="store_true",
+            help="read the inputs and write the PDFs of a batch while rendering"
+            " other invoices, for inputs and outputs on slow storage",
+        )
+        self.parser.add_argument(
+            "--combine",
+            action="store_true",
+            help="render every invoice in the manifest into the single PDF file"
+            " named by -o/--output",
+        )
+        storage = self.parser.add_mutually_exclusive_group()
+        storage.add_argument(
+            "-s",
+            "--stream",
+            dest="storage",
+            action="store_const",
+            const="stream",
+            help="parse invoice items lazily instead of loading them in memory",
+        )
+        storage.add_argument(
+            "-t",
+            "--table",
+            dest="storage",
+            action="store_const",
+            const="table",
+            help="load invoice items in a compact columnar table",
+        )
+        self.parser.add_argument(
+            "--snapshot",
+            metavar="snapshot_file",
+            help="convert the items file into a binary snapshot, which loads much"
+            " faster when given as -i/--items, and exit",
+        )
+        self.parser.add_argument(
+            "--import-items",
+            metavar="database_file",
+            help="append the items file to a SQLite timesheet database (created if"
+            " missing), from which -i/--items selects each invoice's period, and exit",
+        )
+        self.parser.add_argument(
+            "--totals",
+            action="store_true",
+            help="print the invoice totals as json instead of rendering it",
+        )
+        self.parser.add_argument(
+            "--validate-only",
+            action="store_true",
+            help="check the invoice details and items without rendering the invoice",
+        )
+        self.parser.add_argument(
+            "--max-errors",
+            metavar="N",
+            type=int,
+            help="with --validate-only, stop once N errors were found"
+            " (default: report every error)",
+        )
+        self.parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="only render invoices whose inputs changed since they were last"
+            " rendered, as recorded in a build manifest next to each PDF",
+        )
+        self.parser.add_argument(
+            "--cache-fonts",
+            action="store_true",
+            help="parse the invoice fonts into the on-disk font cache and exit",
+        )
+        self.parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="report the time and memory taken by every stage as json on stderr"
+            f" (also enabled by setting {Profiler.ENV_VAR})",
+        )
+        self.parser.add_argument(
+            "-j",
+            "--jobs",
+            metavar="N",
+            type=int,
+            default=1,
+            help="number of worker processes used to render a batch, or to"
+            " validate a large items file (default: 1)",
+        )
+
+        self.serve_parser = argparse.ArgumentParser(prog="project.py serve")
+        self.serve_parser.set_defaults(command="serve")
+        self.serve_parser.add_argument(
+            "--host",
+            default="127.0.0.1",
+            help="address to listen on (default: 127.0.0.1)",
+        )
+        self.serve_parser.add_argument(
+            "-p",
+            "--port",
+            type=int,
+            default=8080,
+            help="port to listen on (default: 8080)",
+        )
+        self.serve_parser.add_argument(
+            "-j",
+            "--jobs",
+            metavar="N",
+            type=int,
+            default=1,
+            help="number of worker processes rendering invoices (default: 1)",
+        )
+        self.serve_parser.add_argument(
+            "--max-requests",
+            metavar="N",
+            type=int,
+            help="number of requests rendered at a time (default: one per worker)",
+        )
+        self.serve_parser.add_argument(
+            "--max-queue",
+            metavar="N",
+            type=int,
+            default=16,
+            help="number of requests waiting to be rendered before new ones are"
+            " turned away (default: 16)",
+        )
+        self.serve_parser.add_argument(
+            "--logo-dir",
+            metavar="directory",
+            help="directory holding the logo images requests may name"
+            " (default: requests cannot have logos)",
         )
 
     def validate_input(self):
-        args = self.parser.parse_args()
-        self.__check_logo(args.logo)
-        self.__check_file(args.details, "details")
-        self.__check_file(args.items, "items")
+        args = self.parse()
         return args.logo, args.details, args.items
 
+    def parse(self):
+        if sys.argv[1:2] == ["serve"]:
+            return self.__parse_serve(sys.argv[2:])
+        args, extras = self.parser.parse_known_args()
+        if args.manifest:
+            self.__check_batch(args)
+        elif args.snapshot or args.import_items:
+            self.__check_conversion(args)
+        elif not args.cache_fonts:
+            self.__check_required(args)
+        if extras:
+            self.parser.error(f"unrecognized arguments: {' '.join(extras)}")
+        if args.jobs < 1:
+            self.parser.error("argument -j/--jobs: must be at least 1")
+        if args.max_errors is not None:
+            self.__check_max_errors(args)
+        if args.incremental:
+            self.__check_incremental(args)
+        if args.combine:
+            self.__check_combine(args)
+        if args.pipeline:
+            self.__check_pipeline(args)
+        if not (
+            args.manifest or args.cache_fonts or args.snapshot or args.import_items
+        ):
+            self.__check_logo(args.logo)
+            self.__check_file(args.details, "details")
+            self.__check_file(args.items, "items")
+        return args
+
+    def __parse_serve(self, argv):
+        args = self.serve_parser.parse_args(argv)
+        if args.max_requests is None:
+            args.max_requests = args.jobs
+        for option, value in (
+            ("-j/--jobs", args.jobs),
+            ("--max-requests", args.max_requests),
+        ):
+            if value < 1:
+                self.serve_parser.error(f"argument {option}: must be at least 1")
+        if args.max_queue < 0:
+            self.serve_parser.error("argument --max-queue: must not be negative")
+        if args.logo_dir and not Path(args.logo_dir).is_dir():
+            self.serve_parser.error(
+                f"argument --logo-dir: '{args.logo_dir}' is not a directory"
+            )
+        return args
+
+    def __check_required(self, args):
+        missing = []
+        if not args.details:
+            missing.append("-d/--details")
+        if not args.items:
+            missing.append("-i/--items")
+        if missing:
+            self.parser.error(
+                f"the following arguments are required: {', '.join(missing)}"
+            )
+
+    def __check_batch(self, args):
+        for option, value in (
+            ("-l/--logo", args.logo),
+            ("-d/--details", args.details),
+            ("-o/--output", args.output and not args.combine),
+            ("--totals", args.totals),
+        ):
+            if value:
+                self.parser.error(f"argument -m/--manifest: not allowed with {option}")
+        self.__check_file(args.manifest, "manifest")
+        if args.items:
+            self.__check_file(args.items, "items")
+
+    def __check_conversion(self, args):
+        option = "--snapshot" if args.snapshot else "--import-items"
+        if args.snapshot and args.import_items:
+            self.parser.error("argument --snapshot: not allowed with --import-items")
+        if not args.items:
+            self.parser.error(f"argument {option}: requires -i/--items")
+        self.__check_file(args.items, "items")
+
+    def __check_combine(self, args):
+        if not (args.manifest and args.output):
+            self.parser.error(
+                "argument --combine: requires -m/--manifest and -o/--output"
+            )
+        for option, value in (
+            ("-j/--jobs", args.jobs > 1),
+            ("--incremental", args.incremental),
+            ("--validate-only", args.validate_only),
+            ("--spool-pages", args.spool_pages),
+        ):
+            if value:
+                self.parser.error(f"argument --combine: not allowed with {option}")
+
+    def __check_pipeline(self, args):
+        if not args.manifest:
+            self.parser.error("argument --pipeline: requires -m/--manifest")
+        for option, value in (
+            ("--combine", args.combine),
+            ("--incremental", args.incremental),
+            ("--validate-only", args.validate_only),
+            ("--spool-pages", args.spool_pages),
+            ("--stream", args.storage == "stream"),
+        ):
+            if value:
+                self.parser.error(f"argument --pipeline: not allowed with {option}")
+
+    def __check_max_errors(self, args):
+        if not args.validate_only:
+            self.parser.error("argument --max-errors: requires --validate-only")
+        if args.max_errors < 1:
+            self.parser.error("argument --max-errors: must be at least 1")
+
+    def __check_incremental(self, args):
+        for option, value in (
+            ("-o -", args.output == "-"),
+            ("--totals", args.totals),
+            ("--validate-only", args.validate_only),
+        ):
+            if value:
+                self.parser.error(f"argument --incremental: not allowed with {option}")
+
     def __check_logo(self, logo):
         if logo:
             try:
-                file_type = magic.from_file(logo, mime=True)
-                if file_type != "image/png" and file_type != "image/jpeg":
-                    print("Invalid image: expected a png or jpg", file=sys.stderr)
-                    sys.exit(2)
-            except FileNotFoundError:
-                print(f"Logo image '{logo}' not found", file=sys.stderr)
-                sys.exit(1)
+                LogoCache.check(logo)
+            except ValueError as ve:
+                print(ve, file=sys.stderr)
+                sys.exit(1 if isinstance(ve, LogoNotFoundError) else 2)
 
     def __check_file(self, file_path, label):
         file = Path(file_path)
@@ -0,0 +1,43 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class AtomicFile:
+    @classmethod
+    @contextmanager
+    def open(cls, file_name, mode="wb"):
+        """
+        Opens a temporary file next to the given one, which replaces it once the
+        block completes (or is removed if the block fails), so that the file is
+        never seen partly written.  It gets the permissions of any file newly
+        created by the process (0o666 less its umask).
+        """
+        directory = Path(file_name).absolute().parent
+        f = tempfile.NamedTemporaryFile(
+            mode, dir=directory, suffix=".tmp", delete=False
+        )
+        try:
+            with f:
+                yield f
+            os.chmod(f.name, 0o666 & ~cls.umask())
+            os.replace(f.name, file_name)
+        except BaseException:
+            os.remove(f.name)
+            raise
+
+    @classmethod
+    def umask(cls):
+        # read from /proc where available: os.umask can only read it by changing
+        # it, which would race with files created by other threads
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("Umask:"):
+                        return int(line.split()[1], 8)
+        except OSError:
+            pass
+        umask = os.umask(0o077)
+        os.umask(umask)
+        return umask
@@ -0,0 +1,65 @@
+import json
+from details import Details
+from logo_cache import LogoCache
+from pathlib import Path
+
+
+class Job:
+    def __init__(self, data, base_dir=".", companies=None, master=None):
+        self.__base_dir = Path(base_dir)
+        self.__set_details(data, companies)
+        self.__set_items(data, master)
+        self.__set_logo(data)
+
+    def __set_details(self, data, companies=None):
+        if "details" not in data and Details.REQUIRED.keys() & data.keys():
+            try:
+                self.details = Details(data, companies)  # a details record
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError("; ".join(Details.errors_in(data)) or str(e))
+            return
+        try:
+            self.details = self.__path_of(data["details"], "details")
+        except KeyError:
+            raise ValueError("Missing job details")
+
+    def __set_items(self, data, master=None):
+        if "items" not in data and master is not None:
+            if not isinstance(self.details, Details):
+                self.details = Details.load(self.details)
+            self.items = master.items_for(self.details)
+            return
+        try:
+            self.items = self.__path_of(data["items"], "items")
+        except KeyError:
+            raise ValueError("Missing job items")
+
+    def __set_logo(self, data):
+        self.logo = None
+        if data.get("logo"):
+            logo = self.__base_dir / data["logo"]
+            LogoCache.check(logo)
+            self.logo = str(logo)
+
+    def __path_of(self, file_name, label):
+        file = self.__base_dir / file_name
+        if not file.exists():
+            raise ValueError(f"Invoice {label} file '{file}' not found")
+        return str(file)
+
+    @classmethod
+    def parse(cls, line, base_dir=".", companies=None, master=None):
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as de:
+            raise ValueError(f"Invalid job: {de.msg}")
+        if not isinstance(data, dict):
+            raise ValueError("Invalid job: expected a json object")
+        return Job(data, base_dir, companies, master)
+
+    @classmethod
+    def lines_from(cls, manifest):
+        with open(manifest) as f:
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    yield number, line
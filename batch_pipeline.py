@@ -0,0 +1,81 @@
+import asyncio
+
+
+class BatchPipeline:
+    def __init__(self, read, render, write, executor, workers=1, depth=4):
+        """
+        Runs batch jobs through three overlapping stages: reading their inputs,
+        rendering them in the given executor (up to workers jobs at a time) and
+        writing the result.  Reading and writing are blocking I/O, run in threads
+        up to depth jobs at a time each, so that the latency of slow storage is
+        hidden behind rendering.  Stages are connected by queues holding up to
+        depth jobs: a slow stage holds back the ones before it, rather than
+        letting prefetched inputs or finished documents pile up in memory.
+        """
+        self.__read = read
+        self.__render = render
+        self.__write = write
+        self.__executor = executor
+        self.__workers = workers
+        self.__depth = depth
+
+    async def run(self, jobs, report):
+        """
+        Runs every (number, job) pair through the pipeline, calling report with
+        the number of each job and either its result or the exception it failed
+        with, as jobs complete.
+        """
+        jobs = iter(jobs)
+        inputs = asyncio.Queue(self.__depth)
+        outputs = asyncio.Queue(self.__depth)
+        readers = [
+            asyncio.create_task(self.__read_all(jobs, inputs, report))
+            for _ in range(self.__depth)
+        ]
+        renderers = [
+            asyncio.create_task(self.__render_all(inputs, outputs, report))
+            for _ in range(self.__workers)
+        ]
+        writers = [
+            asyncio.create_task(self.__write_all(outputs, report))
+            for _ in range(self.__depth)
+        ]
+        await BatchPipeline.__finish(readers, inputs, len(renderers))
+        await BatchPipeline.__finish(renderers, outputs, len(writers))
+        await asyncio.gather(*writers)
+
+    async def __read_all(self, jobs, inputs, report):
+        for number, job in jobs:
+            try:
+                read = await asyncio.to_thread(self.__read, job)
+            except Exception as e:
+                report(number, e)
+                continue
+            await inputs.put((number, read))
+
+    async def __render_all(self, inputs, outputs, report):
+        loop = asyncio.get_running_loop()
+        while (entry := await inputs.get()) is not None:
+            number, read = entry
+            try:
+                rendered = await loop.run_in_executor(
+                    self.__executor, self.__render, *read
+                )
+            except Exception as e:
+                report(number, e)
+                continue
+            await outputs.put((number, rendered))
+
+    async def __write_all(self, outputs, report):
+        while (entry := await outputs.get()) is not None:
+            number, rendered = entry
+            try:
+                report(number, await asyncio.to_thread(self.__write, *rendered))
+            except Exception as e:
+                report(number, e)
+
+    @classmethod
+    async def __finish(cls, tasks, queue, consumers):
+        await asyncio.gather(*tasks)
+        for _ in range(consumers):
+            await queue.put(None)
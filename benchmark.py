@@ -0,0 +1,342 @@
+import argparse
+import csv
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+from details import Details
+from fpdf import FPDF_VERSION, FontFace
+from fpdf.enums import TableCellFillMode
+from invoice import Invoice
+from item import Item
+from item_snapshot import ItemSnapshot
+from item_table import ItemTable
+from output_profile import OutputProfile
+from pathlib import Path
+from totals import Totals
+
+TEST_DATA_DIR = Path(__file__).parent / "test" / "data"
+LOGO = str(TEST_DATA_DIR / "smp.png")
+SIZES = (10, 1_000, 100_000, 1_000_000)
+STAGES = ("load_details", "load_items", "create_invoice", "compute_totals", "print")
+DESCRIPTIONS = [
+    "Fixed main pipeline on north side of castle",
+    "Tested pipeline fixes, looked for leaks",
+    "Replaced 4 toilets on level 2 dungeon",
+    "Replaced faucet on Kamek's workshop",
+    "Replaced toilet's flush valve and flapper on master washroom",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Invoice generator benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    items = commands.add_parser("items", help="memory used to hold line items")
+    items.add_argument("-r", "--rows", type=int, default=100_000)
+    timesheet = commands.add_parser("timesheet", help="time to lay out timesheets")
+    timesheet.add_argument("-r", "--rows", type=int, default=5_000)
+    suite = commands.add_parser("suite", help="time and memory of every stage")
+    suite.add_argument("-s", "--sizes", type=int, nargs="+", default=SIZES)
+    suite.add_argument("-o", "--output", default="benchmark-results.json")
+    profiles = commands.add_parser("profiles", help="cost of every output profile")
+    profiles.add_argument("-s", "--sizes", type=int, nargs="+", default=(10, 5_000))
+    profiles.add_argument("-n", "--repeat", type=int, default=3)
+    compare = commands.add_parser("compare", help="compare two suite results")
+    compare.add_argument("baseline")
+    compare.add_argument("results")
+    args = parser.parse_args()
+
+    if args.command == "items":
+        bench_items(args.rows)
+    elif args.command == "timesheet":
+        bench_timesheet(args.rows)
+    elif args.command == "suite":
+        bench_suite(args.sizes, args.output)
+    elif args.command == "profiles":
+        bench_profiles(args.sizes, args.repeat)
+    elif args.command == "compare":
+        compare_results(args.baseline, args.results)
+
+
+def bench_items(rows):
+    """
+    Compares the memory needed to hold line items in a list of Item objects
+    against a columnar ItemTable, parsed from a synthetic items file of the given
+    size or memory-mapped from its ItemSnapshot.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        items_file = write_items(Path(tmp_dir) / "items.csv", rows)
+        snapshot_file = Path(tmp_dir) / "items.snap"
+        ItemSnapshot.save(items_file, snapshot_file)
+        print(f"{rows:,} rows")
+        for storage, load, file in (
+            ("list", Item.load_all, items_file),
+            ("table", ItemTable.load, items_file),
+            ("snapshot", ItemSnapshot.load, snapshot_file),
+        ):
+            _, retained, peak, seconds = measure(lambda: load(file))
+            print(
+                f"{storage:>8}: {retained / rows:8.1f} bytes/row retained,"
+                f" {peak / rows:8.1f} bytes/row peak, {seconds:6.2f}s"
+            )
+
+
+def bench_timesheet(rows):
+    """
+    Compares the time needed to lay out the detailed timesheet of an invoice with
+    fpdf's generic table() against the specialised TimesheetTable renderer.
+    """
+    details = Details.load(TEST_DATA_DIR / "details.json")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        items = Item.load_all(write_items(Path(tmp_dir) / "items.csv", rows))
+    print(f"{rows:,} rows")
+    for renderer, add_items in (
+        ("table()", add_table_items),
+        ("timesheet", Invoice.add_items),
+    ):
+        invoice = Invoice(None, details, items)
+        invoice.add_page()
+        started = time.perf_counter()  # not measure(): tracemalloc skews timings
+        add_items(invoice)
+        seconds = time.perf_counter() - started
+        print(f"{renderer:>9}: {seconds:6.2f}s, {invoice.page_no()} pages")
+
+
+def bench_suite(sizes, results_file):
+    """
+    Times every stage of rendering an invoice (loading its details and items,
+    creating the Invoice, computing its totals and printing it) for synthetic
+    inputs of the given sizes, with and without a logo.  The stages are run once
+    for their wall time, then once more under tracemalloc (which slows them down)
+    for the peak memory each of them allocates.  Results are written as json, so
+    that runs on different commits can be compared.
+    """
+    Invoice.preload_fonts()  # parsing fonts is a one-off cost, out of any stage
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        for rows in sizes:
+            details_file = write_details(tmp_dir / "details.json", rows)
+            items_file = write_items(tmp_dir / "items.csv", rows)
+            pdf_file = tmp_dir / "invoice.pdf"
+            for logo in (None, LOGO):
+                timings = run_stages(logo, details_file, items_file, pdf_file)
+                tracemalloc.start()
+                try:
+                    peaks = run_stages(logo, details_file, items_file, pdf_file, True)
+                finally:
+                    tracemalloc.stop()
+                for stage in STAGES:
+                    seconds = timings[stage]
+                    result = {
+                        "rows": rows,
+                        "logo": bool(logo),
+                        "stage": stage,
+                        "seconds": seconds,
+                        "rows_per_second": rows / seconds if seconds else None,
+                        "peak_bytes": peaks[stage],
+                    }
+                    if stage == "print":
+                        result["output_bytes"] = pdf_file.stat().st_size
+                    results.append(result)
+                    print(
+                        f"{rows:>9,} rows {'logo' if logo else '':>4}"
+                        f" {stage:>14}: {seconds:8.3f}s,"
+                        f" {peaks[stage] / 1024 ** 2:8.1f} MiB peak"
+                    )
+
+    with open(results_file, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+    print(f"Results written to {results_file}")
+
+
+def bench_profiles(sizes, repeat):
+    """
+    Compares the output profiles of an invoice (with a logo): the CPU time taken
+    to lay it out and print it (the best of a few runs, once fonts and logo have
+    been processed) and the size of the resulting PDF, for each of the given
+    numbers of rows.
+    """
+    Invoice.preload_fonts()
+    details = Details.load(TEST_DATA_DIR / "details.json")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        pdf_file = tmp_dir / "invoice.pdf"
+        for rows in sizes:
+            items = Item.load_all(write_items(tmp_dir / "items.csv", rows))
+            for profile in (None, *OutputProfile.NAMES):
+                Invoice(LOGO, details, items, profile).print(pdf_file)  # warm-up
+                seconds = float("inf")
+                for _ in range(repeat):
+                    invoice = Invoice(LOGO, details, items, profile)
+                    started = time.process_time()
+                    invoice.print(pdf_file)
+                    seconds = min(seconds, time.process_time() - started)
+                print(
+                    f"{rows:>9,} rows {profile or 'default':>8}:"
+                    f" {seconds:8.3f}s CPU, {pdf_file.stat().st_size:>10,} bytes"
+                )
+
+
+def run_stages(logo, details_file, items_file, pdf_file, traced=False):
+    """
+    Renders an invoice stage by stage, returning how long each stage took, or
+    how much memory it allocated at its peak when tracemalloc is tracing.
+    """
+    measurements = {}
+
+    def run(stage, action):
+        if traced:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        result = action()
+        if traced:
+            measurements[stage] = tracemalloc.get_traced_memory()[1] - baseline
+        else:
+            measurements[stage] = time.perf_counter() - started
+        return result
+
+    details = run("load_details", lambda: Details.load(details_file))
+    items = run("load_items", lambda: Item.load_all(items_file))
+    invoice = run("create_invoice", lambda: Invoice(logo, details, items))
+    run("compute_totals", lambda: Totals.of(details, items))
+    run("print", lambda: invoice.print(pdf_file))
+    return measurements
+
+
+def compare_results(baseline_file, results_file):
+    """
+    Prints how the time and peak memory of every stage changed between two
+    suite results files (ratios above 1 mean slower, or more memory).
+    """
+    with open(baseline_file) as f:
+        baseline = {key_of(result): result for result in json.load(f)["results"]}
+    with open(results_file) as f:
+        results = json.load(f)["results"]
+    for result in results:
+        before = baseline.get(key_of(result))
+        if not before:
+            continue
+        rows, logo, stage = key_of(result)
+        print(
+            f"{rows:>9,} rows {'logo' if logo else '':>4} {stage:>14}:"
+            f" {before['seconds']:8.3f}s -> {result['seconds']:8.3f}s"
+            f" ({ratio(result['seconds'], before['seconds'])}),"
+            f" peak {ratio(result['peak_bytes'], before['peak_bytes'])}"
+        )
+
+
+def key_of(result):
+    return result["rows"], result["logo"], result["stage"]
+
+
+def ratio(value, baseline):
+    return f"x{value / baseline:.2f}" if baseline else "n/a"
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            cwd=Path(__file__).parent,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "fpdf2": FPDF_VERSION,
+        "platform": platform.platform(),
+    }
+
+
+def add_table_items(invoice):
+    """
+    Lays out the detailed timesheet of an invoice with fpdf's generic table(),
+    as Invoice.add_items did before TimesheetTable (kept as a reference).
+    """
+    invoice.ln(Invoice.SECTION_SPACING - 5)
+    invoice.set_draw_color(150, 150, 150)
+    invoice.set_line_width(0.3)
+    headings_style = FontFace(fill_color=(220, 220, 220))
+    with invoice.table(
+        borders_layout="NO_HORIZONTAL_LINES",
+        cell_fill_color=(232, 251, 255),
+        cell_fill_mode=TableCellFillMode.ROWS,
+        col_widths=(25, 15, 90),
+        headings_style=headings_style,
+        line_height=6,
+        text_align=("LEFT", "LEFT", "LEFT"),
+        width=190,
+    ) as table:
+        invoice.set_font("CourierPrimeBold", "B", 10)
+        table.row(cells=["Date", "Hours", "Description"])
+
+        invoice.set_font("CourierPrime", "", 9)
+        for data in invoice.items_data:
+            row = table.row()
+            for datum in data:
+                row.cell(datum, padding=[0, 0, 0, 3])
+
+        invoice.set_font("CourierPrimeBold", "B", 9)
+        row = table.row()
+        row.cell("Total Hours:", padding=[0, 0, 0, 3])
+        row.cell(f"{invoice.total_hours}", padding=[0, 0, 0, 3])
+        row.cell("")
+
+
+def write_details(details_file, rows, start=date(2024, 2, 1)):
+    """
+    Writes a details file (based on the sample one) whose invoice period covers
+    the items written by write_items for the same number of rows.
+    """
+    with open(TEST_DATA_DIR / "details.json") as f:
+        details = json.load(f)
+    details["invoice"]["period_start"] = start.isoformat()
+    end = start + timedelta(days=max(rows - 1, 0) // 8)
+    details["invoice"]["period_end"] = end.isoformat()
+    with open(details_file, "w") as f:
+        json.dump(details, f)
+    return details_file
+
+
+def write_items(items_file, rows, start=date(2024, 2, 1)):
+    """
+    Writes a synthetic items file: rows spread over consecutive days, with
+    descriptions drawn from a small set (as in real-life timesheets).
+    """
+    with open(items_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Date", "Hours", "Description"])
+        for i in range(rows):
+            day = start + timedelta(days=i // 8)
+            description = DESCRIPTIONS[i % len(DESCRIPTIONS)]
+            writer.writerow([day.isoformat(), (i % 16 + 1) / 4, description])
+    return items_file
+
+
+def measure(action):
+    """
+    Runs the given action, returning its result along with the memory it
+    retained and peaked at (in bytes), and the elapsed wall time (in seconds).
+    """
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = action()
+        elapsed = time.perf_counter() - started
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, retained, peak, elapsed
+
+
+if __name__ == "__main__":
+    main()
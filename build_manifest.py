@@ -0,0 +1,135 @@
+import hashlib
+import json
+from atomic_file import AtomicFile
+from details import Details
+from file_digest import FileDigest
+from item_table import ItemTable
+from pathlib import Path
+
+
+class BuildManifest:
+    VERSION = 1
+    SOURCES_DIR = Path(__file__).parent
+    SOURCES = (
+        "details.py",
+        "font_registry.py",
+        "invoice.py",
+        "item.py",
+        "item_database.py",
+        "item_snapshot.py",
+        "item_table.py",
+        "logo_cache.py",
+        "master_timesheet.py",
+        "output_profile.py",
+        "page_spool.py",
+        "timesheet_table.py",
+        "totals.py",
+    )
+    INPUTS = ("details", "items", "logo", "fonts", "profile", "generator")
+
+    def __init__(self, pdf_file, inputs):
+        """
+        Records what an invoice PDF was built from: the hash of each of its inputs
+        (details, items, logo, fonts and the generator itself) and the output
+        profile it was rendered with, kept in a small json file next to the PDF.
+        Comparing the current inputs with those recorded tells whether (and why)
+        the PDF needs rebuilding.
+        """
+        self.pdf_file = Path(pdf_file)
+        self.inputs = inputs
+
+    @property
+    def file_name(self):
+        return self.pdf_file.with_name(f"{self.pdf_file.name}.json")
+
+    def changes(self):
+        """
+        Returns the reasons the PDF needs rebuilding, or an empty list when it was
+        built from the current inputs and has not been touched since.
+        """
+        try:
+            pdf = self.pdf_file.stat()
+        except FileNotFoundError:
+            return ["pdf missing"]
+        try:
+            with open(self.file_name) as f:
+                recorded = json.load(f)
+        except FileNotFoundError:
+            return ["no build manifest"]
+        except (OSError, ValueError):
+            return ["unreadable build manifest"]
+        if not isinstance(recorded, dict) or recorded.get("version") != self.VERSION:
+            return ["outdated build manifest"]
+
+        reasons = [
+            f"{name} changed"
+            for name in BuildManifest.INPUTS
+            if recorded.get("inputs", {}).get(name) != self.inputs[name]
+        ]
+        if recorded.get("pdf") != [pdf.st_size, pdf.st_mtime_ns]:
+            reasons.append("pdf modified")
+        return reasons
+
+    def save(self):
+        pdf = self.pdf_file.stat()
+        manifest = {
+            "version": BuildManifest.VERSION,
+            "inputs": self.inputs,
+            "pdf": [pdf.st_size, pdf.st_mtime_ns],
+        }
+        with AtomicFile.open(self.file_name, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    @classmethod
+    def of(cls, pdf_file, logo, details_file, items_file, font_files, profile=None):
+        return BuildManifest(
+            pdf_file,
+            {
+                "details": cls.__details_digest(details_file),
+                "items": cls.__items_digest(items_file),
+                "logo": FileDigest.of(logo) if logo else None,
+                "fonts": cls.__combined(font_files),
+                "profile": profile,
+                "generator": cls.generator_version(),
+            },
+        )
+
+    @classmethod
+    def generator_version(cls):
+        """
+        Identifies the code that renders invoices: the fpdf2 version along with
+        the hash of every module involved in rendering, so that any change to
+        them (not only a release) invalidates previously built PDFs.
+        """
+        from fpdf import FPDF_VERSION
+
+        sources = [cls.SOURCES_DIR / source for source in cls.SOURCES]
+        return f"{cls.VERSION}-{FPDF_VERSION}-{cls.__combined(sources)}"
+
+    @classmethod
+    def __details_digest(cls, details):
+        if not isinstance(details, Details):
+            return FileDigest.of(details)
+        values = json.dumps(vars(details), sort_keys=True, default=str)
+        return hashlib.sha256(values.encode()).hexdigest()
+
+    @classmethod
+    def __items_digest(cls, items):
+        if not isinstance(items, ItemTable):
+            return FileDigest.of(items)
+        digest = hashlib.sha256()
+        dates, hours, codes, descriptions = items.columns
+        for column in (dates, hours, codes):
+            digest.update(column)
+        for code in sorted(set(codes)):
+            digest.update(f"{descriptions[code]}\n".encode())
+        return digest.hexdigest()
+
+    @classmethod
+    def __combined(cls, file_names):
+        digest = hashlib.sha256()
+        for file_name in file_names:
+            digest.update(
+                f"{Path(file_name).name}:{FileDigest.of(file_name)}\n".encode()
+            )
+        return digest.hexdigest()
@@ -1,15 +1,34 @@
 import json
+from datetime import date
 
 
 class Details:
-    def __init__(self, data):
-        self.__set_company(data)
+    REQUIRED = {
+        "company": ("name", "street", "city", "state", "zip_code", "phone", "email"),
+        "customer": ("name", "street", "city", "state", "zip_code"),
+        "invoice": (
+            "number",
+            "date",
+            "period_start",
+            "period_end",
+            "description",
+            "terms",
+            "unit_cost",
+        ),
+    }
+
+    def __init__(self, data, companies=None):
+        self.__set_company(data, companies)
         self.__set_customer(data)
         self.__set_invoice(data)
 
-    def __set_company(self, data):
+    def __set_company(self, data, companies=None):
         try:
             company = data["company"]
+            key = Details.__company_key(company) if companies is not None else None
+            if key in (companies or {}):
+                vars(self).update(companies[key])
+                return
             self.company_name = company["name"]
             self.company_street = company["street"]
             self.company_city = company["city"]
@@ -17,6 +36,8 @@ class Details:
             self.company_zip_code = company["zip_code"]
             self.company_phone = company["phone"]
             self.company_email = company["email"]
+            if key is not None:
+                companies[key] = dict(vars(self))
         except KeyError as ke:
             raise ValueError(f"Missing company {self.att(ke)}")
 
@@ -42,6 +63,7 @@ class Details:
             self.invoice_terms = invoice["terms"]
             self.invoice_tax_label = invoice.get("tax_label")
             self.invoice_tax_rate = invoice.get("tax_rate")
+            self.invoice_project = invoice.get("project")
             self.__set_unit_cost(invoice)
         except KeyError as ke:
             raise ValueError(f"Missing invoice {self.att(ke)}")
@@ -52,6 +74,50 @@ class Details:
         except ValueError as ve:
             raise ValueError(f"Invalid unit cost: '{invoice['unit_cost']}'")
 
+    @property
+    def invoice_period(self):
+        """
+        Returns the first and last days of the invoice period, as dates.
+        """
+        try:
+            start = date.fromisoformat(self.invoice_period_start)
+        except (TypeError, ValueError):
+            raise ValueError(
+                f"Invalid invoice period start '{self.invoice_period_start}'"
+            )
+        try:
+            end = date.fromisoformat(self.invoice_period_end)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid invoice period end '{self.invoice_period_end}'")
+        return start, end
+
+    @classmethod
+    def errors_in(cls, data):
+        """
+        Returns every problem with the invoice details data (each missing entry,
+        rather than only the first), or an empty list if it is valid.
+        """
+        if not isinstance(data, dict):
+            return ["Invalid details: expected a json object"]
+        errors = []
+        for section, keys in Details.REQUIRED.items():
+            values = data.get(section)
+            if not isinstance(values, dict):
+                errors.append(f"Missing {section} {section}")
+                continue
+            errors.extend(
+                f"Missing {section} {key.replace('_', ' ')}"
+                for key in keys
+                if key not in values
+            )
+        invoice = data.get("invoice")
+        if isinstance(invoice, dict) and "unit_cost" in invoice:
+            try:
+                float(invoice["unit_cost"])
+            except (TypeError, ValueError):
+                errors.append(f"Invalid unit cost: '{invoice['unit_cost']}'")
+        return errors
+
     def att(self, error):
         return error.args[0].replace("_", " ")
 
@@ -59,6 +125,15 @@ class Details:
     def load(cls, file):
         return Details(Details.__data_from(file))
 
+    @classmethod
+    def __company_key(cls, company):
+        try:
+            key = tuple(company.items())
+            hash(key)
+            return key
+        except (AttributeError, TypeError):
+            return None  # not a flat json object: validated on every use
+
     @classmethod
     def __data_from(cls, file_name):
         with open(file_name) as f:
@@ -0,0 +1,29 @@
+import functools
+import hashlib
+from pathlib import Path
+
+
+class FileDigest:
+    MAX_FILES = 256
+    CHUNK_SIZE = 1024 * 1024
+
+    @classmethod
+    def of(cls, file_name):
+        """
+        Returns the sha256 of a file's contents, read in chunks (so that large
+        files are never held in memory), and only once per process until the
+        file's size or modification time change.  The digests of the most
+        recently used MAX_FILES files are kept.
+        """
+        stat = Path(file_name).stat()
+        key = str(Path(file_name).resolve()), stat.st_size, stat.st_mtime_ns
+        return FileDigest.__of(*key)
+
+    @staticmethod
+    @functools.lru_cache(MAX_FILES)
+    def __of(path, size, mtime_ns):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(FileDigest.CHUNK_SIZE):
+                digest.update(chunk)
+        return digest.hexdigest()
@@ -0,0 +1,173 @@
+import copy
+import hashlib
+import marshal
+import mmap
+import os
+from atomic_file import AtomicFile
+from collections import defaultdict
+from fontTools import ttLib
+from fpdf import FPDF, FPDF_VERSION
+from fpdf.enums import FontDescriptorFlags, TextEmphasis
+from fpdf.font_type_3 import get_color_font_object
+from fpdf.fonts import PDFFontDescriptor, SubsetMap, TTFFont
+from io import BytesIO
+from pathlib import Path
+
+
+class FontRegistry:
+    FONTS_DIR = Path(__file__).parent / "fonts"
+
+    __parsed = {}
+
+    @classmethod
+    def add_font(cls, pdf, family, style, file_name):
+        """
+        Makes a bundled font available to the given document, like FPDF.add_font,
+        but parsing each font file only once per process.  The glyph metrics are
+        shared by every document, while the state mutated when a document is
+        output (glyph subset, font descriptor, font file) is private to it.
+        """
+        template, data = cls.__parse(cls.FONTS_DIR / file_name, pdf)
+        fontkey = f"{family.lower()}{style}"
+        font = copy.copy(template)
+        font.i = len(pdf.fonts) + 1
+        font.fontkey = fontkey
+        font.emphasis = TextEmphasis.coerce(style)
+        font.desc = copy.copy(template.desc)
+        font.ttfont = FontCache.open(data, template.collection_font_number)
+        font.subset = SubsetMap(font)
+        font.missing_glyphs = []
+        font.biggest_size_pt = 0
+        if template.color_font:
+            font.color_font = get_color_font_object(pdf, font, font.palette_index)
+        pdf.fonts[fontkey] = font
+
+    @classmethod
+    def preload(cls, file_names):
+        pdf = FPDF()
+        for file_name in file_names:
+            cls.__parse(cls.FONTS_DIR / file_name, pdf)
+
+    @classmethod
+    def __parse(cls, font_file, pdf):
+        if font_file not in cls.__parsed:
+            data = font_file.read_bytes()
+            template = FontCache.load(font_file, data, pdf)
+            if not template:
+                template = TTFFont(pdf, font_file, font_file.stem.lower(), "")
+                FontCache.save(font_file, template)
+            cls.__parsed[font_file] = (template, data)
+        return cls.__parsed[font_file]
+
+
+class FontCache:
+    VERSION = 1
+    ATTRIBUTES = (
+        "type",
+        "name",
+        "scale",
+        "up",
+        "ut",
+        "sp",
+        "ss",
+        "palette_index",
+        "is_compressed",
+        "is_cff",
+        "is_cid_keyed",
+        "is_symbol",
+        "cff_ros",
+        "collection_font_number",
+    )
+    DESCRIPTOR = (
+        "ascent",
+        "descent",
+        "cap_height",
+        "font_b_box",
+        "italic_angle",
+        "stem_v",
+        "missing_width",
+    )
+
+    @classmethod
+    def directory(cls):
+        default = FontRegistry.FONTS_DIR / ".cache"
+        return Path(os.environ.get("INVOICER_FONT_CACHE", default))
+
+    @classmethod
+    def load(cls, font_file, data, pdf):
+        """
+        Rebuilds a parsed font from its cached metrics, or returns None when the
+        cache entry is missing or stale (the font file's path, size or
+        modification time changed, or it was written by another fpdf2 version).
+        """
+        try:
+            with open(cls.__entry_for(font_file), "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as entry:
+                    key, metrics = marshal.loads(entry)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if key != cls.__key(font_file):
+            return None
+
+        font = TTFFont.__new__(TTFFont)
+        for name in cls.ATTRIBUTES:
+            setattr(font, name, metrics[name])
+        missing_width = metrics["desc"]["missing_width"]
+        font.desc = PDFFontDescriptor(
+            flags=FontDescriptorFlags(metrics["flags"]), **metrics["desc"]
+        )
+        font.cw = defaultdict(lambda: missing_width, metrics["cw"])
+        font.cmap = metrics["cmap"]
+        font.glyph_ids = metrics["glyph_ids"]
+        font.i = 0
+        font.ttffile = font_file
+        font.fontkey = font_file.stem.lower()
+        font.emphasis = TextEmphasis.NONE
+        font.ttfont = cls.open(data, font.collection_font_number)
+        font.subset = None
+        font.missing_glyphs = []
+        font.biggest_size_pt = 0
+        font._hbfont = None
+        font.color_font = None
+        if pdf.render_color_fonts:
+            font.color_font = get_color_font_object(pdf, font, font.palette_index)
+        return font
+
+    @classmethod
+    def save(cls, font_file, font):
+        metrics = {name: getattr(font, name) for name in cls.ATTRIBUTES}
+        metrics["desc"] = {name: getattr(font.desc, name) for name in cls.DESCRIPTOR}
+        metrics["flags"] = font.desc.flags.value
+        metrics["cw"] = dict(font.cw)
+        metrics["cmap"] = dict(font.cmap)
+        metrics["glyph_ids"] = dict(font.glyph_ids)
+        entry = cls.__entry_for(font_file)
+        try:
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            with AtomicFile.open(entry) as f:
+                f.write(marshal.dumps((cls.__key(font_file), metrics)))
+        except OSError:
+            pass  # the cache is an optimisation: a read-only location just disables it
+
+    @classmethod
+    def open(cls, data, font_number=0):
+        return ttLib.TTFont(
+            BytesIO(data), recalcTimestamp=False, fontNumber=font_number, lazy=True
+        )
+
+    @classmethod
+    def __entry_for(cls, font_file):
+        # fonts with the same name in different directories get entries of their own
+        path = hashlib.sha256(str(font_file.resolve()).encode()).hexdigest()
+        return cls.directory() / f"{font_file.name}-{path[:16]}.metrics"
+
+    @classmethod
+    def __key(cls, font_file):
+        stat = font_file.stat()
+        return (
+            str(font_file.resolve()),
+            stat.st_size,
+            stat.st_mtime_ns,
+            FPDF_VERSION,
+            cls.VERSION,
+        )
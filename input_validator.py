@@ -0,0 +1,216 @@
+import csv
+import json
+import locale
+import os
+from details import Details
+from item import Item
+from item_database import ItemDatabase
+from item_format import ItemFormat
+from item_snapshot import ItemSnapshot
+from item_table import ItemTable
+
+
+class InputValidator:
+    COLUMNS = {"Date": "date", "Hours": "hours", "Description": "description"}
+    CHUNK_SIZE = 4 * 1024 * 1024
+    BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, max_errors=None):
+        """
+        Checks the inputs of an invoice the way rendering it would, but reports
+        every problem found (up to max_errors, if given) instead of stopping at
+        the first, each along with the file and line it was found on.  Items
+        files larger than CHUNK_SIZE can be split in byte ranges, each starting
+        on a record boundary, that are checked by parallel worker processes.
+        """
+        self.max_errors = max_errors
+        self.errors = []
+        self.items = 0
+        self.details = None
+
+    @property
+    def stopped(self):
+        return self.max_errors is not None and len(self.errors) >= self.max_errors
+
+    def check_details(self, details_file):
+        if isinstance(details_file, Details):
+            self.details = details_file  # read from a JSON Lines stream, and checked
+            return
+        try:
+            with open(details_file) as f:
+                data = json.load(f)
+        except json.JSONDecodeError as de:
+            self.__add([f"{details_file}:{de.lineno}: {de.msg}"])
+            return
+        errors = Details.errors_in(data)
+        self.__add([f"{details_file}: {error}" for error in errors])
+        if not errors:
+            self.details = Details(data)
+
+    def check_items(self, items_file, jobs=1):
+        if isinstance(items_file, ItemTable):
+            self.items += len(items_file)  # cut from a master items file, checked
+            return
+        item_format = ItemFormat.of_file(items_file)
+        if item_format == ItemFormat.SNAPSHOT:
+            self.items += len(ItemSnapshot.load(items_file))  # checked when saved
+            return
+        if item_format == ItemFormat.DATABASE:
+            self.__check_query(items_file)
+            return
+        fieldnames, ranges = InputValidator.__ranges(items_file, jobs)
+        missing = [
+            f"{items_file}:1: Missing item {name} column"
+            for column, name in InputValidator.COLUMNS.items()
+            if column not in fieldnames
+        ]
+        if fieldnames and missing:
+            self.__add(missing)  # rather than the same error on every row
+            return
+
+        if len(ranges) == 1:
+            self.__add_outcome(
+                InputValidator.check_range(
+                    items_file, *ranges[0], fieldnames, self.__remaining()
+                )
+            )
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(min(jobs, len(ranges))) as pool:
+            outcomes = [
+                pool.submit(
+                    InputValidator.check_range,
+                    items_file,
+                    *item_range,
+                    fieldnames,
+                    self.__remaining(),
+                )
+                for item_range in ranges
+            ]
+            for outcome in outcomes:
+                self.__add_outcome(outcome.result())
+                if self.stopped:
+                    pool.shutdown(cancel_futures=True)
+                    break
+
+    def __check_query(self, database_file):
+        if self.details is None:
+            return  # the invoice period is unknown
+        try:
+            self.items += len(ItemDatabase.query(database_file, self.details))
+        except ValueError as ve:  # items were checked when imported
+            self.__add([f"{database_file}: {ve}"])
+
+    def report(self):
+        if self.stopped:
+            summary = f"stopped after {len(self.errors)} error(s)"
+        else:
+            summary = f"{len(self.errors)} error(s) in {self.items} item(s)"
+        return "\n".join([*self.errors, summary])
+
+    def __remaining(self):
+        if self.max_errors is None:
+            return None
+        return self.max_errors - len(self.errors)
+
+    def __add(self, errors):
+        self.errors.extend(errors[: self.__remaining()])
+
+    def __add_outcome(self, outcome):
+        count, errors = outcome
+        self.items += count
+        self.__add(errors)
+
+    @classmethod
+    def check_range(cls, file_name, start, end, line, fieldnames, max_errors=None):
+        """
+        Checks the items held between two byte offsets of an items file, the first
+        of them on the given line.  Returns the number of items found along with
+        the errors in them, having stopped early if max_errors were found.
+        """
+        encoding = locale.getpreferredencoding(False)
+        errors = []
+        count = 0
+
+        def lines(f):
+            position, number = start, line
+            while position < end and (raw := f.readline()):
+                position += len(raw)
+                try:
+                    yield raw.decode(encoding)
+                except UnicodeDecodeError:
+                    errors.append(f"{file_name}:{number}: Invalid {encoding} text")
+                    yield raw.decode(encoding, errors="replace")
+                number += 1
+
+        with open(file_name, "rb") as f:
+            f.seek(start)
+            reader = csv.reader(lines(f))
+            consumed = 0
+            while max_errors is None or len(errors) < max_errors:
+                number = line + consumed
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    break
+                except csv.Error as ce:
+                    errors.append(f"{file_name}:{number}: {ce}")
+                    break
+                consumed = reader.line_num
+                if not row:
+                    continue  # blank lines are skipped, as by csv.DictReader
+                count += 1
+                errors.extend(
+                    f"{file_name}:{number}: {error}"
+                    for error in Item.errors_in(dict(zip(fieldnames, row)))
+                )
+        return count, errors[:max_errors]
+
+    @classmethod
+    def __ranges(cls, file_name, jobs):
+        """
+        Returns the column names of an items file, and the byte ranges (along with
+        the line each starts on) it is checked in: a single one, unless the file
+        is large enough to be split between jobs.  Ranges only start after a line
+        break that is not within a quoted field (one preceded by an even number
+        of quotes), so that no record is split between two of them.
+        """
+        encoding = locale.getpreferredencoding(False)
+        size = os.path.getsize(file_name)
+        with open(file_name, "rb") as f:
+            header = f.readline()
+            fieldnames = next(csv.reader([header.decode(encoding)]), [])
+            start = len(header)
+            count = min(jobs * 4, (size - start) // InputValidator.CHUNK_SIZE)
+            if jobs == 1 or count <= 1:
+                return fieldnames, [(start, size, 2)]
+
+            step = (size - start) // count
+            targets = iter(range(start + step, size, step))
+            target = next(targets)
+            starts = [(start, 2)]
+            position, quotes, newlines = start, 0, 0
+            while target is not None and (block := f.read(InputValidator.BLOCK_SIZE)):
+                counted = search = 0
+                while target is not None:
+                    newline = block.find(b"\n", max(search, target - position))
+                    if newline < 0:
+                        break
+                    quotes += block.count(b'"', counted, newline)
+                    newlines += block.count(b"\n", counted, newline) + 1
+                    counted = search = newline + 1
+                    boundary = position + counted
+                    if quotes % 2 == 0 and boundary < size:
+                        starts.append((boundary, 2 + newlines))
+                        while target is not None and target < boundary:
+                            target = next(targets, None)
+                quotes += block.count(b'"', counted)
+                newlines += block.count(b"\n", counted)
+                position += len(block)
+
+        ends = [item_start for item_start, _ in starts[1:]] + [size]
+        return fieldnames, [
+            (item_start, end, line) for (item_start, line), end in zip(starts, ends)
+        ]
@@ -1,17 +1,45 @@
+import os
+import types
 from datetime import date
+from io import BytesIO
 from fpdf import FPDF, FontFace
 from fpdf.enums import TableCellFillMode
-import functools
+from atomic_file import AtomicFile
+from font_registry import FontRegistry
+from item_table import ItemTable
+from logo_cache import LogoCache
+from output_profile import OutputProfile
+from page_spool import OutputSink, PageSpool
+from profiler import Profiler
+from timesheet_table import TimesheetTable
+from totals import Totals
 
 
 class Invoice(FPDF):
     SECTION_SPACING = 20
-
-    def __init__(self, logo, details, items):
+    FONTS = (
+        ("Anta", "", "Anta-Regular.ttf"),
+        ("CourierPrime", "", "CourierPrime-Regular.ttf"),
+        ("CourierPrime", "B", "CourierPrime-Regular.ttf"),
+        ("CourierPrimeBold", "B", "CourierPrime-Bold.ttf"),
+        ("CourierPrimeItalic", "I", "CourierPrime-Italic.ttf"),
+    )
+
+    def __init__(self, logo, details, items, profile=None, spool_pages=False):
         super().__init__()
-        self.__add_fonts()
+        self.__spool = PageSpool() if spool_pages else None
+        self.__sink = None
+        self.__profile = OutputProfile.named(profile)
+        with Profiler.stage("register_fonts"):
+            self.__add_fonts()
+        self.__appended = []
+        self.__first_page = 1
+        self.__closed_page = 0
+        self.__set_invoice(logo, details, items)
+
+    def __set_invoice(self, logo, details, items):
         self.__logo = logo
-        self.__items = items
+        self.items = items
         self.__number = details.invoice_number
         self.__date = details.invoice_date
         self.__description = details.invoice_description
@@ -34,12 +62,29 @@ class Invoice(FPDF):
         self.__tax_label = details.invoice_tax_label
         self.__tax_rate = details.invoice_tax_rate
 
+    def append_invoice(self, logo, details, items):
+        """
+        Appends another invoice to the document, laid out after this one (and any
+        appended before it) on pages of its own, with its own header, footer and
+        page numbering.  Fonts, and logos shared by several invoices, are only
+        embedded once in the document.
+        """
+        if self.page:
+            raise ValueError("Invoices cannot be appended once laid out")
+        self.__appended.append((logo, details, items))
+
     def __add_fonts(self):
-        self.add_font("Anta", "", "fonts/Anta-Regular.ttf")
-        self.add_font("CourierPrime", "", "fonts/CourierPrime-Regular.ttf")
-        self.add_font("CourierPrime", "B", "fonts/CourierPrime-Regular.ttf")
-        self.add_font("CourierPrimeBold", "B", "fonts/CourierPrime-Bold.ttf")
-        self.add_font("CourierPrimeItalic", "I", "fonts/CourierPrime-Italic.ttf")
+        for family, style, file_name in Invoice.FONTS:
+            FontRegistry.add_font(self, family, style, file_name)
+
+    @classmethod
+    def preload_fonts(cls):
+        FontRegistry.preload({file_name for _, _, file_name in Invoice.FONTS})
+
+    @classmethod
+    def font_files(cls):
+        file_names = sorted({file_name for _, _, file_name in Invoice.FONTS})
+        return [FontRegistry.FONTS_DIR / file_name for file_name in file_names]
 
     def __len__(self):
         return len(self.items)
@@ -48,6 +93,22 @@ class Invoice(FPDF):
     def items(self):
         return self.__items
 
+    @items.setter
+    def items(self, items):
+        # items are held read-only, so that the memoised totals cannot go stale
+        if isinstance(items, list):
+            items = tuple(items)
+        elif isinstance(items, ItemTable):
+            items = items.read_only()
+        self.__items = items
+        self.__totals = None
+
+    @property
+    def totals(self):
+        if self.__totals is None:
+            self.__totals = Totals(self.__items, self.__unit_cost, self.__tax_rate)
+        return self.__totals
+
     @property
     def issuer(self):
         return self.__issuer
@@ -95,9 +156,15 @@ class Invoice(FPDF):
         end_date = date.fromisoformat(self.__period_end)
         return f"To: {end_date.strftime('%B %d, %Y')}"
 
+    @property
+    def items_data(self):
+        if isinstance(self.__items, ItemTable):
+            return self.__items.data
+        return (item.data for item in self.__items)
+
     @property
     def total_hours(self):
-        return functools.reduce(lambda total, item: total + item.hours, self.__items, 0)
+        return self.totals.hours
 
     def __str__(self):
         return self.invoice_number
@@ -106,13 +173,21 @@ class Invoice(FPDF):
     def invoice_number(self):
         return f"Invoice # {self.__number}"
 
+    @property
+    def file_name(self):
+        return Invoice.file_name_for(self.__number)
+
+    @classmethod
+    def file_name_for(cls, number):
+        return f"invoice-{number}.pdf"
+
     @property
     def unit_cost(self):
         return self.__unit_cost
 
     @property
     def total_cost(self):
-        return self.total_hours * self.unit_cost
+        return self.totals.cost
 
     @property
     def tax_label(self):
@@ -124,15 +199,15 @@ class Invoice(FPDF):
 
     @property
     def tax_amount(self):
-        return round(self.total_cost * self.tax_rate, 2)
-    
+        return self.totals.tax_amount
+
     @property
     def tax_amount_label(self):
         return f"${self.tax_amount:6,.2f}" if self.tax_amount else ""
 
     @property
     def amount_due(self):
-        return round(self.total_cost + self.tax_amount, 2)
+        return self.totals.amount_due
 
     def header(self):
         self.add_logo()
@@ -151,38 +226,150 @@ class Invoice(FPDF):
         self.__set_content_top_margin()
 
     def __set_content_top_margin(self):
-        top_margin = Invoice.SECTION_SPACING if self.page_no() < 3 else 40
+        top_margin = Invoice.SECTION_SPACING if self.page_in_invoice < 3 else 40
         self.set_y(top_margin)
 
+    @property
+    def page_in_invoice(self):
+        return self.page_no() - self.__first_page + 1
+
     def footer(self):
+        if self.page == self.__closed_page:
+            return  # drawn when the invoice was closed
         self.set_y(-15)
         self.set_font("CourierPrimeItalic", "I", 8)
         self.set_text_color(128)
         self.cell(0, 10, self.invoice_number, align="L")
-        self.cell(0, 10, f"Page {self.page_no()} of {{nb}}", align="R")
+        self.cell(0, 10, f"Page {self.page_in_invoice} of {{nb}}", align="R")
 
     def add_logo(self):
         if self.__logo:
-            self.image(self.__logo, x=6, y=10, w=15)
+            LogoCache.add_logo(
+                self,
+                self.__logo,
+                x=6,
+                y=10,
+                w=15,
+                dpi=self.__profile.logo_dpi,
+                quality=self.__profile.jpeg_quality,
+            )
 
     @property
     def left_margin(self):
         return 15 if self.__logo else 2
 
-    def print(self):
-        self.add_page()
-        self.add_top_panel()
-        self.add_customer_info()
-        self.add_invoice_info()
-        self.add_summary()
-        self.add_terms_info()
-
-        self.add_page()
-        self.add_timesheet_period()
-        self.add_description()
-        self.add_items()
-
-        self.output(f"invoice-{self.__number}.pdf")
+    def print(self, output=None):
+        output = output or self.file_name
+        if self.__spool:
+            if isinstance(output, (str, os.PathLike)):
+                # written out as it is laid out: a failure never leaves a
+                # truncated PDF in place
+                with AtomicFile.open(output) as f:
+                    self.__print_spooled(f)
+            else:
+                self.__print_spooled(output)
+            return
+        with self.__profile.applied():
+            self.__lay_out()
+            with Profiler.stage("output"):
+                self.output(output)
+
+    def to_bytes(self):
+        if self.__spool:
+            stream = BytesIO()
+            self.__print_spooled(stream)
+            return stream.getvalue()
+        with self.__profile.applied():
+            self.__lay_out()
+            with Profiler.stage("output"):
+                return bytes(self.output())
+
+    def __print_spooled(self, stream):
+        # finished pages are written to the spool as the invoice is laid out, and
+        # the document to the stream as it is serialised, so that neither is
+        # ever held in memory as a whole
+        if self.buffer:
+            raise ValueError("Invoices with spooled pages can only be output once")
+        try:
+            with self.__profile.applied():
+                self.__lay_out()
+                with Profiler.stage("output"):
+                    self.__sink = OutputSink(stream)
+                    producer = self.__spool.output_producer(self.__sink)
+                    self.output(output_producer_class=producer)
+        finally:
+            self.__sink = None
+            self.__spool.close()
+
+    def _beginpage(self, *args, **kwargs):
+        # the page being left is finished (its footer drawn), unless writing is
+        # disabled, as on pages laid out by a dry run and discarded afterwards
+        # (checked as fpdf's _disable_writing does, see PageSpool.FPDF_VERSIONS)
+        if self.__spool and self.page and isinstance(self._out, types.MethodType):
+            self.__spool.spill(self.pages[self.page])
+        super()._beginpage(*args, **kwargs)
+
+    def file_id(self):
+        # a streamed document is no longer in memory: the sink it is written to
+        # identifies it as fpdf would have
+        if self.__sink is None:
+            return super().file_id()
+        return self.__sink.file_id(self.creation_date)
+
+    def __lay_out(self):
+        if self.page:
+            return  # already laid out (fpdf keeps the document buffer once output)
+        self.__lay_out_invoice()
+        for logo, details, items in self.__appended:
+            self.__set_invoice(logo, details, items)
+            self.__lay_out_invoice()
+
+    def __lay_out_invoice(self):
+        if self.page:
+            self.__reset_graphics_state()
+        self.__first_page = self.page + 1
+        for section in (
+            self.add_page,
+            self.add_top_panel,
+            self.add_customer_info,
+            self.add_invoice_info,
+            self.add_summary,
+            self.add_terms_info,
+            self.add_page,
+            self.add_timesheet_period,
+            self.add_description,
+            self.add_items,
+        ):
+            with Profiler.stage(section.__name__):
+                section()
+        self.__close_invoice()
+
+    def __reset_graphics_state(self):
+        # fpdf carries the font, colours and line width left behind by the last
+        # page over to the next one; an appended invoice starts from the same
+        # state as a new document, so that it renders exactly as it would alone
+        self.font_family, self.font_style, self.font_size_pt = "", "", 12
+        self.current_font = None
+        self.draw_color = self.DEFAULT_DRAW_COLOR
+        self.fill_color = self.DEFAULT_FILL_COLOR
+        self.text_color = self.DEFAULT_TEXT_COLOR
+        self.line_width = 0.567 / self.k
+
+    def __close_invoice(self):
+        # the last page's footer is drawn now, while this invoice's details are
+        # current, so that {nb} can be replaced by this invoice's page count (as
+        # fpdf would with the document's) before the next invoice starts
+        self._render_footer()
+        self.__closed_page = self.page
+        page_count = str(self.page - self.__first_page + 1)
+        for page in range(self.__first_page, self.page + 1):
+            substitutions = self.pages[page].get_text_substitutions()
+            for substitution in substitutions:
+                self.pages[page].contents = self.pages[page].contents.replace(
+                    substitution.get_placeholder_string().encode("latin-1"),
+                    substitution.render_text_substitution(page_count).encode("latin-1"),
+                )
+            substitutions.clear()
 
     def add_top_panel(self):
         self.ln(Invoice.SECTION_SPACING)
@@ -212,7 +399,7 @@ class Invoice(FPDF):
         self.ln(Invoice.SECTION_SPACING)
         self.set_draw_color(150, 150, 150)
         self.set_line_width(0.3)
-        headings_style = FontFace(emphasis="", color=0)
+        headings_style = FontFace(family="CourierPrime", emphasis="", color=0)
         with self.table(
             borders_layout="NO_HORIZONTAL_LINES",
             cell_fill_color=(232, 251, 255),
@@ -278,28 +465,6 @@ class Invoice(FPDF):
         self.ln(Invoice.SECTION_SPACING - 5)
         self.set_draw_color(150, 150, 150)
         self.set_line_width(0.3)
-        headings_style = FontFace(fill_color=(220, 220, 220))
-        with self.table(
-            borders_layout="NO_HORIZONTAL_LINES",
-            cell_fill_color=(232, 251, 255),
-            cell_fill_mode=TableCellFillMode.ROWS,
-            col_widths=(25, 15, 90),
-            headings_style=headings_style,
-            line_height=6,
-            text_align=("LEFT", "LEFT", "LEFT"),
-            width=190,
-        ) as table:
-            self.set_font("CourierPrimeBold", "B", 10)
-            table.row(cells=["Date", "Hours", "Description"])
-
-            self.set_font("CourierPrime", "", 9)
-            for item in self.items:
-                row = table.row()
-                for datum in item.data:
-                    row.cell(datum, padding=[0, 0, 0, 3])
-
-            self.set_font("CourierPrimeBold", "B", 9)
-            row = table.row()
-            row.cell("Total Hours:", padding=[0, 0, 0, 3])
-            row.cell(f"{self.total_hours}", padding=[0, 0, 0, 3])
-            row.cell("")
+        TimesheetTable(self).render(
+            self.items_data, ["Total Hours:", f"{self.total_hours}", ""]
+        )
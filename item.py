@@ -3,6 +3,8 @@ from datetime import date
 
 
 class Item:
+    __slots__ = ("__date", "__hours", "__description")
+
     def __init__(self, data):
         self.__set_date(data)
         self.__set_hours(data)
@@ -38,6 +40,10 @@ class Item:
     def date(self):
         return self.__date.strftime("%b %d, %Y")
 
+    @property
+    def ordinal(self):
+        return self.__date.toordinal()
+
     @property
     def hours(self):
         return self.__hours
@@ -50,15 +56,51 @@ class Item:
     def data(self):
         return [self.date, f"{self.hours}", self.description]
 
+    @classmethod
+    def of(cls, day, hours, description):
+        item = Item.__new__(Item)
+        item.__date = day
+        item.__hours = hours
+        item.__description = description
+        return item
+
+    @classmethod
+    def errors_in(cls, data):
+        """
+        Returns every problem with a row of item data (rather than only the first,
+        as raised when creating an Item from it), or an empty list if it is valid.
+        """
+        item = Item.__new__(Item)
+        errors = []
+        for check in (item.__set_date, item.__set_hours, item.__set_description):
+            try:
+                check(data)
+            except ValueError as ve:
+                errors.append(f"{ve}")
+        return errors
+
     @classmethod
     def load_all(cls, file):
-        return [Item(i) for i in Item.__items_from(file)]
+        return list(Item.iter_file(file))
 
     @classmethod
-    def __items_from(cls, file_name):
-        data = []
+    def iter_file(cls, file_name):
         with open(file_name) as f:
-            for row in csv.DictReader(f):
-                data.append(row)
+            yield from Item.iter_lines(f)
+
+    @classmethod
+    def iter_lines(cls, lines):
+        for row in csv.DictReader(lines):
+            yield Item(row)
+
+
+class ItemStream:
+    def __init__(self, file_name):
+        self.__file_name = file_name
+
+    def __iter__(self):
+        return Item.iter_file(self.__file_name)
 
-        return data
+    def __len__(self):
+        with open(self.__file_name) as f:
+            return sum(1 for _ in csv.DictReader(f))
@@ -0,0 +1,133 @@
+import csv
+from datetime import date
+from item import Item
+from pathlib import Path
+
+
+class ItemDatabase:
+    MAGIC = b"SQLite format 3\x00"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS items (
+            date INTEGER NOT NULL,
+            hours REAL NOT NULL,
+            description TEXT NOT NULL,
+            customer TEXT NOT NULL DEFAULT '',
+            project TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS items_by_customer ON items (customer, date);
+        CREATE INDEX IF NOT EXISTS items_by_project ON items (project, date);
+    """
+
+    def __init__(self, details):
+        """
+        Selects the line items of an invoice from a SQLite timesheet database:
+        those dated within the invoice period, for the invoice's customer (or
+        for no customer in particular) and, when the invoice names a project,
+        for that project.  Rows are streamed through a cursor every time the
+        items are iterated over, using the index on customer (or project) and
+        date, so that only the invoice period is ever read.
+        """
+        self.__start, self.__end = details.invoice_period
+        self.__customer = details.customer_name
+        self.__project = details.invoice_project
+
+    def __condition(self):
+        if self.__project:
+            return "project = ? AND date BETWEEN ? AND ?", (
+                self.__project,
+                self.__start.toordinal(),
+                self.__end.toordinal(),
+            )
+        return "customer IN ('', ?) AND date BETWEEN ? AND ?", (
+            f"{self.__customer}",
+            self.__start.toordinal(),
+            self.__end.toordinal(),
+        )
+
+    @classmethod
+    def query(cls, database_file, details):
+        """
+        Returns the line items of an invoice held in a timesheet database, as an
+        iterable ItemQuery that reads them lazily.
+        """
+        return ItemQuery(database_file, ItemDatabase(details))
+
+    def select(self, connection):
+        where, parameters = self.__condition()
+        return connection.execute(
+            "SELECT date, hours, description FROM items"
+            f" WHERE {where} ORDER BY date, rowid",
+            parameters,
+        )
+
+    def count(self, connection):
+        where, parameters = self.__condition()
+        (count,) = connection.execute(
+            f"SELECT COUNT(*) FROM items WHERE {where}", parameters
+        ).fetchone()
+        return count
+
+    @classmethod
+    def add(cls, database_file, items_file):
+        """
+        Appends the line items of a csv file to a timesheet database (creating it
+        if needed), validating every item along the way.  Items files may carry
+        optional Customer and Project columns; items with no customer are billed
+        on any invoice covering their date.  The function returns the number of
+        items added.
+        """
+        import sqlite3  # deferred: only needed by timesheet databases
+
+        with open(items_file) as f:
+            rows = csv.DictReader(f)
+            connection = sqlite3.connect(database_file)
+            try:
+                with connection:
+                    connection.executescript(ItemDatabase.SCHEMA)
+                    cursor = connection.executemany(
+                        "INSERT INTO items VALUES (?, ?, ?, ?, ?)",
+                        (ItemDatabase.__values_of(row) for row in rows),
+                    )
+                return cursor.rowcount
+            finally:
+                connection.close()
+
+    @classmethod
+    def __values_of(cls, row):
+        item = Item(row)
+        return (
+            item.ordinal,
+            item.hours,
+            item.description,
+            row.get("Customer") or "",
+            row.get("Project") or "",
+        )
+
+    @classmethod
+    def connect(cls, database_file):
+        import sqlite3  # deferred: only needed by timesheet databases
+
+        return sqlite3.connect(
+            f"{Path(database_file).resolve().as_uri()}?mode=ro", uri=True
+        )
+
+
+class ItemQuery:
+    def __init__(self, database_file, selection):
+        self.__database_file = database_file
+        self.__selection = selection
+
+    def __iter__(self):
+        connection = ItemDatabase.connect(self.__database_file)
+        try:
+            for ordinal, hours, description in self.__selection.select(connection):
+                yield Item.of(date.fromordinal(ordinal), hours, description)
+        finally:
+            connection.close()
+
+    def __len__(self):
+        connection = ItemDatabase.connect(self.__database_file)
+        try:
+            return self.__selection.count(connection)
+        finally:
+            connection.close()
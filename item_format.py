@@ -0,0 +1,27 @@
+from item_database import ItemDatabase
+from item_snapshot import ItemSnapshot
+
+
+class ItemFormat:
+    CSV = "csv"
+    SNAPSHOT = "snapshot"
+    DATABASE = "database"
+
+    @classmethod
+    def of(cls, items_file):
+        """
+        Tells what an open binary items file holds (csv text, an items snapshot or
+        a timesheet database) from its first bytes only, which are left to be
+        read.
+        """
+        header = items_file.peek(len(ItemDatabase.MAGIC))
+        if header.startswith(ItemSnapshot.MAGIC):
+            return ItemFormat.SNAPSHOT
+        if header.startswith(ItemDatabase.MAGIC):
+            return ItemFormat.DATABASE
+        return ItemFormat.CSV
+
+    @classmethod
+    def of_file(cls, file_name):
+        with open(file_name, "rb") as f:
+            return ItemFormat.of(f)
@@ -0,0 +1,100 @@
+import mmap
+import struct
+import sys
+from array import array
+from atomic_file import AtomicFile
+from item_table import ItemTable
+
+
+class ItemSnapshot:
+    MAGIC = b"INVITEMS"
+    VERSION = 1
+    BYTE_ORDER = 0x01020304
+    HEADER = struct.Struct("=8sIIQQ")
+
+    @classmethod
+    def save(cls, items_file, snapshot_file):
+        """
+        Converts an items csv file into a snapshot, validating every item along
+        the way.  After a fixed header (magic, version, byte order, item and
+        description counts), a snapshot holds the hours (float64), the offsets of
+        every distinct description in the string table (uint64), the dates as
+        ordinals (int32), the description code of each item (uint32) and the
+        string table itself (utf-8).  Columns are written in the byte order of
+        the machine, and aligned so that they can be used in place from a
+        memory-mapped file.  The function returns the number of items converted.
+        """
+        dates, hours, codes, descriptions = ItemTable.load(items_file).columns
+        encoded = [description.encode() for description in descriptions]
+        offsets = array("Q", [0])
+        for text in encoded:
+            offsets.append(offsets[-1] + len(text))
+
+        with AtomicFile.open(snapshot_file) as f:
+            f.write(
+                ItemSnapshot.HEADER.pack(
+                    ItemSnapshot.MAGIC,
+                    ItemSnapshot.VERSION,
+                    ItemSnapshot.BYTE_ORDER,
+                    len(hours),
+                    len(descriptions),
+                )
+            )
+            for column in (hours, offsets, dates, codes):
+                column.tofile(f)
+            f.writelines(encoded)
+        return len(hours)
+
+    @classmethod
+    def load(cls, snapshot_file):
+        """
+        Memory-maps a snapshot, returning its items in an ItemTable whose dates,
+        hours and description codes are read from the mapped file in place; only
+        the distinct descriptions are decoded.
+        """
+        with open(snapshot_file, "rb") as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"Invalid items snapshot '{snapshot_file}'")
+        view = memoryview(buffer)
+        count, distinct = ItemSnapshot.__check_header(view, snapshot_file)
+
+        layout = (("d", count), ("Q", distinct + 1), ("i", count), ("I", count))
+        position = ItemSnapshot.HEADER.size
+        columns = []
+        for code, length in layout:
+            size = struct.calcsize(code) * length
+            if position + size > len(view):
+                raise ValueError(f"Invalid items snapshot '{snapshot_file}': truncated")
+            columns.append(view[position : position + size].cast(code))
+            position += size
+        hours, offsets, dates, codes = columns
+        strings = view[position:]
+        if len(strings) != offsets[-1]:
+            raise ValueError(f"Invalid items snapshot '{snapshot_file}': truncated")
+        descriptions = [
+            str(strings[start:end], "utf-8") for start, end in zip(offsets, offsets[1:])
+        ]
+        return ItemTable.of(dates, hours, codes, descriptions)
+
+    @classmethod
+    def __check_header(cls, view, snapshot_file):
+        try:
+            magic, version, order, count, distinct = ItemSnapshot.HEADER.unpack_from(
+                view
+            )
+        except struct.error:
+            magic = None
+        if magic != ItemSnapshot.MAGIC:
+            raise ValueError(f"Invalid items snapshot '{snapshot_file}'")
+        if version != ItemSnapshot.VERSION:
+            raise ValueError(
+                f"Invalid items snapshot '{snapshot_file}': unsupported version {version}"
+            )
+        if order != ItemSnapshot.BYTE_ORDER:
+            raise ValueError(
+                f"Invalid items snapshot '{snapshot_file}': written on a machine"
+                f" with a different byte order than this {sys.byteorder}-endian one"
+            )
+        return count, distinct
@@ -0,0 +1,103 @@
+import functools
+import operator
+from array import array
+from datetime import date
+from item import Item
+
+
+class ItemTable:
+    def __init__(self, items=()):
+        self.__dates = array("i")
+        self.__hours = array("d")
+        self.__codes = array("I")
+        self.__descriptions = []
+        self.__lookup = {}
+        self.extend(items)
+
+    def append(self, item):
+        if self.__lookup is None:
+            raise TypeError("Cannot append to a read-only ItemTable")
+        self.__dates.append(item.ordinal)
+        self.__hours.append(item.hours)
+        self.__codes.append(self.__code_for(item.description))
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __code_for(self, description):
+        code = self.__lookup.get(description)
+        if code is None:
+            code = self.__lookup[description] = len(self.__descriptions)
+            self.__descriptions.append(description)
+        return code
+
+    def __len__(self):
+        return len(self.__hours)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ItemTable.of(
+                self.__dates[index],
+                self.__hours[index],
+                self.__codes[index],
+                self.__descriptions,
+            )
+        return Item.of(
+            date.fromordinal(self.__dates[index]),
+            self.__hours[index],
+            self.__descriptions[self.__codes[index]],
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def columns(self):
+        return self.__dates, self.__hours, self.__codes, self.__descriptions
+
+    @property
+    def total_hours(self):
+        return functools.reduce(operator.add, self.__hours, 0)
+
+    @property
+    def data(self):
+        dates = {}
+        for ordinal, hours, code in zip(self.__dates, self.__hours, self.__codes):
+            if ordinal not in dates:
+                dates[ordinal] = date.fromordinal(ordinal).strftime("%b %d, %Y")
+            yield [dates[ordinal], f"{hours}", self.__descriptions[code]]
+
+    def read_only(self):
+        """
+        Returns a read-only table of the same items: the columns of a table that
+        can still be appended to are copied, while those of a read-only table
+        (such as the memoryviews of an ItemSnapshot) are shared.
+        """
+        if self.__lookup is None:
+            return self
+        return ItemTable.of(
+            array("i", self.__dates),
+            array("d", self.__hours),
+            array("I", self.__codes),
+            list(self.__descriptions),
+        )
+
+    @classmethod
+    def load(cls, file):
+        return ItemTable(Item.iter_file(file))
+
+    @classmethod
+    def of(cls, dates, hours, codes, descriptions):
+        """
+        Creates a read-only table over existing columns, such as the memoryviews
+        of an ItemSnapshot, without copying them.
+        """
+        table = ItemTable.__new__(ItemTable)
+        table.__dates = dates
+        table.__hours = hours
+        table.__codes = codes
+        table.__descriptions = descriptions
+        table.__lookup = None
+        return table
@@ -0,0 +1,137 @@
+import copy
+import functools
+from collections import OrderedDict
+from file_digest import FileDigest
+from io import BytesIO
+from pathlib import Path
+
+
+class LogoCache:
+    DPI = 300
+    JPEG_QUALITY = 90
+    MIME_TYPES = ("image/png", "image/jpeg")
+    MAX_FILES = 256
+    MAX_PROCESSED = 32
+
+    __processed = OrderedDict()
+
+    @classmethod
+    def mime_type(cls, file_name):
+        """
+        Returns the MIME type of an image file, as reported by libmagic, but only
+        checking each file once per process (until its size or modification time
+        change).  Raises FileNotFoundError when the file does not exist.
+        """
+        return LogoCache.__mime_type_of(*LogoCache.__key_of(file_name))
+
+    @classmethod
+    def __key_of(cls, file_name):
+        stat = Path(file_name).stat()
+        return str(Path(file_name).resolve()), stat.st_size, stat.st_mtime_ns
+
+    # the most recently used files are kept, so that a long-running process
+    # (such as the render service) does not accumulate every logo it has seen
+    @staticmethod
+    @functools.lru_cache(MAX_FILES)
+    def __mime_type_of(path, size, mtime_ns):
+        import magic  # deferred: libmagic is only needed to check logos
+
+        return magic.from_file(path, mime=True)
+
+    @classmethod
+    def is_supported(cls, file_name):
+        return cls.mime_type(file_name) in LogoCache.MIME_TYPES
+
+    @classmethod
+    def check(cls, file_name):
+        """
+        Checks that a logo image exists and is a png or jpg, raising a ValueError
+        saying what is wrong otherwise (a LogoNotFoundError when it is missing).
+        """
+        try:
+            supported = cls.is_supported(file_name)
+        except FileNotFoundError:
+            raise LogoNotFoundError(f"Logo image '{file_name}' not found")
+        if not supported:
+            raise ValueError("Invalid image: expected a png or jpg")
+
+    @classmethod
+    def add_logo(cls, pdf, file_name, x, y, w, dpi=DPI, quality=JPEG_QUALITY):
+        """
+        Places a logo image on the current page of the given document, like
+        FPDF.image, but decoding each image only once per process.  Images wider
+        than needed to print w millimetres wide at the given dpi are downscaled
+        first (JPEG images being re-encoded with the given quality).  Processed
+        images are keyed by the hash of the file contents, and are embedded in
+        each document only once, however many pages show them.  Only the most
+        recently used MAX_PROCESSED images are kept.
+        """
+        from fpdf.image_parsing import SETTINGS
+
+        pixels = round(w / 25.4 * dpi)
+        key = (
+            FileDigest.of(file_name),
+            pixels,
+            pdf.image_cache.image_filter,
+            quality,
+            SETTINGS.compression_level,
+        )
+        name = f"logo-{key[0]}-{pixels}"
+        if name not in pdf.image_cache.images:
+            cls.__register(pdf, name, cls.__processed_for(key, file_name))
+        pdf.image(name, x=x, y=y, w=w)
+
+    @classmethod
+    def __processed_for(cls, key, file_name):
+        processed = cls.__processed.get(key)
+        if processed is not None:
+            cls.__processed.move_to_end(key)
+            return processed
+        _, pixels, image_filter, quality, _ = key
+        processed = cls.__process(
+            Path(file_name).read_bytes(), pixels, image_filter, quality
+        )
+        if len(cls.__processed) >= LogoCache.MAX_PROCESSED:
+            cls.__processed.popitem(last=False)
+        cls.__processed[key] = processed
+        return processed
+
+    @classmethod
+    def __process(cls, data, pixels, image_filter, quality):
+        from fpdf.image_parsing import get_img_info
+        from PIL import Image
+
+        image = Image.open(BytesIO(data))
+        if image.width <= pixels:
+            return get_img_info("logo", BytesIO(data), image_filter)
+
+        source_format = image.format
+        if image.mode not in ("L", "LA", "RGB", "RGBA"):
+            image = image.convert("RGBA")
+        height = max(1, round(image.height * pixels / image.width))
+        image = image.resize((pixels, height), Image.LANCZOS)
+        if source_format == "JPEG" and image.mode in ("L", "RGB"):
+            jpeg = BytesIO()  # kept as a jpeg, so that it is embedded as one
+            image.save(jpeg, "JPEG", quality=quality)
+            return get_img_info("logo", jpeg, image_filter)
+        return get_img_info("logo", image, image_filter)
+
+    @classmethod
+    def __register(cls, pdf, name, template):
+        # mirrors fpdf.image_parsing.preload_image, sharing the image data
+        info = copy.copy(template)
+        info["i"] = len(pdf.image_cache.images) + 1
+        info["usages"] = 0
+        info["iccp_i"] = None
+        iccp = template.get("iccp")
+        if iccp is not None:
+            icc_profiles = pdf.image_cache.icc_profiles
+            if iccp not in icc_profiles:
+                icc_profiles[iccp] = len(icc_profiles)
+            info["iccp_i"] = icc_profiles[iccp]
+            info["iccp"] = None
+        pdf.image_cache.images[name] = info
+
+
+class LogoNotFoundError(ValueError):
+    pass
@@ -0,0 +1,74 @@
+import csv
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from item import Item
+from item_table import ItemTable
+
+
+class MasterTimesheet:
+    COLUMNS = ("Customer", "Project")
+
+    def __init__(self, table, rows):
+        """
+        Holds the line items of a master items file, parsed once, from which the
+        items of any number of invoices are cut.  Items are selected as from a
+        timesheet database (see ItemDatabase): those dated within the invoice
+        period, for the invoice's customer (or for no customer in particular)
+        and, when the invoice names a project, for that project.  Every customer
+        and project has the numbers of its rows sorted by date, along with their
+        dates, so that the rows of a period are found by binary search.
+        """
+        self.__table = table
+        self.__rows = rows
+
+    def items_for(self, details):
+        """
+        Returns the items of the invoice with the given details, in a compact
+        ItemTable holding a copy of them, in date order (and file order within
+        a date).
+        """
+        if details.invoice_project:
+            keys = [("Project", details.invoice_project)]
+        else:
+            keys = {("Customer", ""), ("Customer", f"{details.customer_name}")}
+        start, end = details.invoice_period
+        selected = []
+        for key in keys:
+            rows, dates = self.__rows.get(key, ((), ()))
+            first = bisect_left(dates, start.toordinal())
+            last = bisect_right(dates, end.toordinal(), first)
+            selected.append(rows[first:last])
+        dates, hours, codes, descriptions = self.__table.columns
+        order = list(heapq.merge(*selected, key=lambda row: (dates[row], row)))
+        return ItemTable.of(
+            array("i", (dates[row] for row in order)),
+            array("d", (hours[row] for row in order)),
+            array("I", (codes[row] for row in order)),
+            descriptions,
+        )
+
+    @classmethod
+    def load(cls, file_name):
+        """
+        Parses and validates a master items file, indexing its rows by date
+        within each customer and each project (items with no Customer or Project
+        column have no customer or project in particular).
+        """
+        table = ItemTable()
+        numbers = {}
+        with open(file_name) as f:
+            for number, row in enumerate(csv.DictReader(f)):
+                table.append(Item(row))
+                for column in MasterTimesheet.COLUMNS:
+                    key = column, row.get(column) or ""
+                    numbers.setdefault(key, []).append(number)
+        dates = table.columns[0]
+        rows = {}
+        for key, key_numbers in numbers.items():
+            key_numbers.sort(key=dates.__getitem__)
+            rows[key] = (
+                array("I", key_numbers),
+                array("i", (dates[number] for number in key_numbers)),
+            )
+        return MasterTimesheet(table, rows)
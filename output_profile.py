@@ -0,0 +1,125 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class OutputProfile:
+    NAMES = ("fast", "small")
+
+    __level = ContextVar("compression_level", default=None)
+    __lock = threading.Lock()
+    __applied = 0
+    __originals = None
+
+    def __init__(self, name, compression_level, logo_dpi, jpeg_quality):
+        """
+        Settles how an invoice is serialised, trading bytes for CPU time: the zlib
+        level used for page contents, font files and images, and the resolution
+        (and JPEG quality) logos are resampled to.  fpdf2 always subsets fonts and
+        writes a classic xref table (no object streams), so neither is a setting.
+        """
+        self.name = name
+        self.compression_level = compression_level
+        self.logo_dpi = logo_dpi
+        self.jpeg_quality = jpeg_quality
+
+    @classmethod
+    def named(cls, name=None):
+        if name is None:
+            return DEFAULT
+        try:
+            return PROFILES[name]
+        except KeyError:
+            raise ValueError(f"Invalid output profile: '{name}'")
+
+    @contextmanager
+    def applied(self):
+        """
+        Applies the profile's compression level to the streams compressed while
+        in context.  The level is held in a context variable, so that invoices
+        rendered at the same time by different threads (as by the render service)
+        each get their own.  fpdf2's own settings are back in place once no
+        profile is applied any more.
+        """
+        token = OutputProfile.__level.set(self.compression_level)
+        OutputProfile.__install()
+        try:
+            yield
+        finally:
+            OutputProfile.__uninstall()
+            OutputProfile.__level.reset(token)
+
+    @classmethod
+    def __install(cls):
+        # fpdf2 only has process-wide settings for the level, read when a stream
+        # is compressed: while any profile is applied, both are made to read it
+        # from the current context (falling back to fpdf2's own outside of it)
+        from fpdf import image_parsing
+        from fpdf.syntax import PDFContentStream
+
+        with OutputProfile.__lock:
+            if OutputProfile.__applied == 0:
+                level, settings = (
+                    PDFContentStream._COMPRESSION_LEVEL,
+                    image_parsing.SETTINGS,
+                )
+                OutputProfile.__originals = level, settings
+                PDFContentStream._COMPRESSION_LEVEL = ContextLevel(
+                    OutputProfile.__level, level
+                )
+                image_parsing.SETTINGS = ContextImageSettings(
+                    settings, OutputProfile.__level
+                )
+            OutputProfile.__applied += 1
+
+    @classmethod
+    def __uninstall(cls):
+        from fpdf import image_parsing
+        from fpdf.syntax import PDFContentStream
+
+        with OutputProfile.__lock:
+            OutputProfile.__applied -= 1
+            if OutputProfile.__applied == 0:
+                level, settings = OutputProfile.__originals
+                PDFContentStream._COMPRESSION_LEVEL = level
+                image_parsing.SETTINGS = settings
+
+
+class ContextLevel:
+    def __init__(self, level, default):
+        self.__level = level
+        self.__default = default
+
+    def __get__(self, instance, owner=None):
+        level = self.__level.get()
+        return self.__default if level is None else level
+
+
+class ContextImageSettings:
+    # stands in for fpdf's image_parsing.SETTINGS, which it reads through to
+    def __init__(self, settings, level):
+        self.__settings = settings
+        self.__level = level
+
+    @property
+    def compression_level(self):
+        level = self.__level.get()
+        return self.__settings.compression_level if level is None else level
+
+    @compression_level.setter
+    def compression_level(self, compression_level):
+        self.__settings.compression_level = compression_level
+
+    def __getattr__(self, name):
+        return getattr(self.__settings, name)
+
+
+DEFAULT = OutputProfile(None, -1, 300, 90)
+PROFILES = {
+    # transient previews: the cheapest zlib level (leaving streams uncompressed
+    # saves little more CPU, for five times the bytes)
+    "fast": OutputProfile("fast", 1, 300, 90),
+    # archival and email: the strongest zlib level, and logos resampled to a
+    # resolution that still prints cleanly at their size
+    "small": OutputProfile("small", 9, 150, 75),
+}
@@ -0,0 +1,171 @@
+import hashlib
+import tempfile
+import zlib
+from functools import partial
+from fpdf import FPDF_VERSION
+from fpdf.output import OutputProducer
+from fpdf.syntax import Name, PDFContentStream, PDFObject
+
+
+class PageSpool:
+    # the fpdf2 releases whose page and output internals this was checked against
+    # (as pinned in requirements.txt)
+    FPDF_VERSIONS = "2.8."
+
+    def __init__(self):
+        """
+        Keeps the contents of finished pages in a temporary file rather than in
+        memory.  Spilled pages hold a SpooledPage instead of their content
+        stream, which is read back (one page at a time) when the document is
+        written out by a StreamingOutputProducer.
+        """
+        if not FPDF_VERSION.startswith(PageSpool.FPDF_VERSIONS):
+            raise RuntimeError(
+                f"Spooling pages is not supported with fpdf2 {FPDF_VERSION}"
+                f" (only with fpdf2 {PageSpool.FPDF_VERSIONS}x)"
+            )
+        self.__file = tempfile.TemporaryFile()
+        self.__size = 0
+
+    def spill(self, page):
+        if not isinstance(page.contents, bytearray):
+            return  # already spilled
+        self.__file.seek(self.__size)
+        self.__file.write(page.contents)
+        page.contents = SpooledPage(self, self.__size, len(page.contents))
+        self.__size += page.contents.length
+
+    def read(self, offset, length):
+        self.__file.seek(offset)
+        return self.__file.read(length)
+
+    def close(self):
+        self.__file.close()
+
+    def output_producer(self, sink):
+        """
+        Returns the output producer class (as FPDF.output expects it) writing the
+        document to the given OutputSink.
+        """
+        return partial(StreamingOutputProducer, sink=sink)
+
+
+class SpooledPage:
+    def __init__(self, spool, offset, length, replacements=()):
+        """
+        The contents of a page held in a PageSpool.  Like the bytearray it
+        replaces, it supports replace(), which fpdf uses to substitute the total
+        page count ({nb}) once known: replacements are recorded, and applied when
+        the contents are read back.
+        """
+        self.__spool = spool
+        self.__offset = offset
+        self.length = length
+        self.__replacements = replacements
+
+    def replace(self, old, new):
+        return SpooledPage(
+            self.__spool,
+            self.__offset,
+            self.length,
+            (*self.__replacements, (bytes(old), bytes(new))),
+        )
+
+    def read(self):
+        contents = self.__spool.read(self.__offset, self.length)
+        for old, new in self.__replacements:
+            contents = contents.replace(old, new)
+        return contents
+
+
+class SpooledContentStream(PDFContentStream):
+    def __init__(self, page, compress=False):
+        PDFObject.__init__(self)
+        self.__page = page
+        self.__compress = compress
+        self._contents = b""
+        self.filter = Name("FlateDecode") if compress else None
+        self.length = 0
+
+    def serialize(self, obj_dict=None, _security_handler=None):
+        # the page is only read back (and compressed) while being written out
+        contents = self.__page.read()
+        if self.__compress:
+            contents = zlib.compress(contents, level=self._COMPRESSION_LEVEL)
+        self._contents, self.length = contents, len(contents)
+        try:
+            return super().serialize(obj_dict, _security_handler)
+        finally:
+            self._contents = b""
+
+
+class StreamingOutputProducer(OutputProducer):
+    def __init__(self, fpdf, sink):
+        """
+        Writes a document to a binary stream object by object, as it is
+        serialised, rather than building it in memory: offsets for the xref
+        table are counted as objects are written.  Pages held in a PageSpool are
+        read back one at a time.
+        """
+        super().__init__(fpdf)
+        self.buffer = sink
+
+    def _add_pages(self, _slice=slice(0, None)):
+        spooled = {}
+        for page in self.fpdf.pages.values():
+            if isinstance(page.contents, SpooledPage):
+                spooled[page.index()] = page.contents
+                page.contents = bytearray()  # swapped for the spooled contents below
+        start = len(self.pdf_objs)
+        page_objs = super()._add_pages(_slice)
+        positions = {
+            id(obj): position
+            for position, obj in enumerate(self.pdf_objs[start:], start)
+        }
+        for page_obj in page_objs:
+            page = spooled.get(page_obj.index())
+            if page is None:
+                continue
+            position = positions.get(id(page_obj.contents))
+            if position is None:
+                raise RuntimeError(
+                    f"Spooled page {page_obj.index()} has no content stream to"
+                    f" replace (with fpdf2 {FPDF_VERSION})"
+                )
+            contents = SpooledContentStream(page, self.fpdf.compress)
+            contents.id = page_obj.contents.id
+            self.pdf_objs[position] = page_obj.contents = contents
+        return page_objs
+
+
+class OutputSink:
+    def __init__(self, output):
+        """
+        Stands in for the buffer of an OutputProducer, writing everything added
+        to it to the output, and keeping its length and an md5 of its contents
+        (from which the file identifier is derived) as it goes.
+        """
+        self.__output = output
+        self.__size = 0
+        self.__hash = hashlib.new("md5", usedforsecurity=False)
+
+    def __iadd__(self, data):
+        self.__output.write(data)
+        self.__size += len(data)
+        self.__hash.update(data)
+        return self
+
+    def file_id(self, creation_date=None):
+        """
+        Returns the identifier fpdf gives a document held in memory (see
+        FPDF.file_id): the md5 of the contents written so far, and of the
+        creation date.
+        """
+        id_hash = self.__hash.copy()
+        if creation_date:
+            id_hash.update(creation_date.strftime("%Y%m%d%H%M%S").encode("utf8"))
+        hash_hex = id_hash.hexdigest().upper()
+        return f"<{hash_hex}><{hash_hex}>"
+
+    def __len__(self):
+        return self.__size
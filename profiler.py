@@ -0,0 +1,67 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Profiler:
+    ENV_VAR = "INVOICER_PROFILE"
+
+    __stages = None
+
+    @classmethod
+    def requested(cls, argv):
+        return "--profile" in argv or bool(os.environ.get(Profiler.ENV_VAR))
+
+    @classmethod
+    def start(cls):
+        """
+        Starts recording the wall time, CPU time and peak memory of every stage
+        run from then on.  Stages are not recorded (and cost next to nothing)
+        unless the profiler was started.
+        """
+        cls.__stages = []
+        tracemalloc.start()
+
+    @classmethod
+    def stop(cls):
+        stages, cls.__stages = cls.__stages, None
+        tracemalloc.stop()
+        return stages
+
+    @classmethod
+    @contextmanager
+    def stage(cls, name):
+        if cls.__stages is None:
+            yield
+            return
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            cls.__stages.append(
+                {
+                    "stage": name,
+                    "wall_seconds": round(time.perf_counter() - wall, 6),
+                    "cpu_seconds": round(time.process_time() - cpu, 6),
+                    "peak_bytes": tracemalloc.get_traced_memory()[1] - baseline,
+                }
+            )
+
+    @classmethod
+    def report(cls, file=sys.stderr):
+        """
+        Stops the profiler and writes the stages it recorded as a json report
+        on a single line (so that it can be picked out of a log).
+        """
+        stages = cls.stop()
+        report = {
+            "stages": stages,
+            "wall_seconds": round(sum(stage["wall_seconds"] for stage in stages), 6),
+            "cpu_seconds": round(sum(stage["cpu_seconds"] for stage in stages), 6),
+        }
+        print(json.dumps(report), file=file)
@@ -1,17 +1,126 @@
+import io
+import json
 import sys
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
 from arg_parser import ArgParser
+from batch import Job
 from details import Details
-from invoice import Invoice
-from item import Item
+from item import Item, ItemStream
+from item_database import ItemDatabase
+from item_format import ItemFormat
+from item_snapshot import ItemSnapshot
+from item_table import ItemTable
+from master_timesheet import MasterTimesheet
+from profiler import Profiler
+from totals import Totals
 
 
 def main():
+    profiling = Profiler.requested(sys.argv[1:])
+    if profiling:
+        Profiler.start()
     try:
-        logo, details, items = parse_args()
-        invoice = create_invoice(logo, details, items)
-        invoice.print()
+        with Profiler.stage("validate_input"):
+            options = parse_options()
+        if options.command == "serve":
+            serve(
+                options.host,
+                options.port,
+                options.jobs,
+                options.max_requests,
+                options.max_queue,
+                options.logo_dir,
+            )
+            return
+        if options.cache_fonts:
+            cache_fonts()
+            sys.exit(0)
+        if options.snapshot:
+            print(snapshot_items(options.items, options.snapshot))
+            return
+        if options.import_items:
+            print(import_items(options.items, options.import_items))
+            return
+        if options.combine:
+            output = sys.stdout.buffer if options.output == "-" else options.output
+            count = combine_invoices(
+                options.manifest,
+                output,
+                options.storage,
+                options.output_profile,
+                options.items,
+            )
+            print(f"{count} invoice(s) combined", file=sys.stderr)
+            return
+        if options.pipeline:
+            failures = run_pipeline(
+                options.manifest,
+                options.jobs,
+                options.storage,
+                options.output_profile,
+                options.items,
+            )
+            sys.exit(1 if failures else 0)
+        if options.manifest:
+            failures = run_batch(
+                options.manifest,
+                options.jobs,
+                options.storage,
+                options.validate_only,
+                options.incremental,
+                options.output_profile,
+                options.max_errors,
+                options.items,
+                options.spool_pages,
+            )
+            sys.exit(1 if failures else 0)
+        if options.validate_only:
+            print(
+                validate_invoice(
+                    options.logo,
+                    options.details,
+                    options.items,
+                    jobs=options.jobs,
+                    max_errors=options.max_errors,
+                )
+            )
+            return
+        if options.totals:
+            totals = compute_totals(options.details, options.items, options.storage)
+            print(json.dumps(vars(totals), indent=2))
+            return
+        if options.incremental:
+            print(
+                build_invoice(
+                    options.logo,
+                    options.details,
+                    options.items,
+                    options.storage,
+                    options.output,
+                    options.output_profile,
+                    options.spool_pages,
+                )
+            )
+            return
+        invoice = create_invoice(
+            options.logo,
+            options.details,
+            options.items,
+            options.storage,
+            options.output_profile,
+            options.spool_pages,
+        )
+        if options.output == "-":
+            invoice.print(sys.stdout.buffer)
+        else:
+            invoice.print(options.output)
     except Exception as e:
         sys.exit(e)
+    finally:
+        if profiling:
+            Profiler.report()
 
 
 def parse_args():
@@ -25,28 +134,451 @@ def parse_args():
     return ArgParser().validate_input()
 
 
-def create_invoice(logo_image, details_file, items_file):
+def parse_options():
+    """
+    Parses command-line arguments, performing the same preliminary validation as
+    parse_args, but returns all the parsed options (including batch mode ones).
+    """
+    return ArgParser().parse()
+
+
+def create_invoice(
+    logo_image, details_file, items_file, storage=None, profile=None, spool_pages=False
+):
     """
     Creates an invoice instance from the user supplied information.
+    The storage argument selects how line items are held (see load_items), and
+    the profile how the invoice is serialised (see OutputProfile).  When spooling
+    pages, finished pages are kept in a temporary file rather than in memory,
+    and the invoice is written out as it is serialised (see PageSpool).
     """
-    details = load_details(details_file)
-    items = load_items(items_file)
-    invoice: Invoice = Invoice(logo_image, details, items)
+    with Profiler.stage("load_details"):
+        details = load_details(details_file)
+    with Profiler.stage("load_items"):
+        items = load_items(items_file, storage, details)
+    from invoice import Invoice  # deferred: fpdf is only needed to render
+
+    invoice: Invoice = Invoice(logo_image, details, items, profile, spool_pages)
     return invoice
 
 
+def compute_totals(details_file, items_file, storage=None):
+    """
+    Computes the totals of an invoice (hours, cost, tax and amount due) from the
+    user supplied information, without laying out a PDF document.
+    """
+    details = load_details(details_file)
+    return Totals.of(details, load_items(items_file, storage, details))
+
+
 def load_details(details_file):
     """
-    Loads invoice details from a user supplied json file.
+    Loads invoice details from a user supplied json file (details already read
+    from a JSON Lines stream, as in batch mode, are returned as they are).
     """
+    if isinstance(details_file, Details):
+        return details_file
     return Details.load(details_file)
 
 
-def load_items(items_file):
+def load_items(items_file, storage=None, details=None):
     """
-    Loads line items from a user supplied csv file.
+    Loads line items from a user supplied csv file, or the items of the invoice
+    with the given details from a timesheet database (see import_items).
+    By default items are loaded in a list of Item objects. Other storages are:
+    "stream" -> the file is not loaded up-front; instead, rows are parsed and
+                validated one at a time, every time the items are iterated over
+    "table"  -> items are loaded in a compact, columnar ItemTable
+    Items snapshots (see snapshot_items) are always memory-mapped in an ItemTable.
+    Items already loaded (say, cut from a master items file by MasterTimesheet)
+    are returned as they are.
     """
-    return Item.load_all(items_file)
+    if isinstance(items_file, (ItemTable, list)):
+        return items_file
+    with open(items_file, "rb") as f:
+        item_format = ItemFormat.of(f)
+        if item_format == ItemFormat.CSV:  # parsed from the file already open
+            if storage == "stream":
+                return ItemStream(items_file)
+            items = Item.iter_lines(io.TextIOWrapper(f))
+            return ItemTable(items) if storage == "table" else list(items)
+    if item_format == ItemFormat.SNAPSHOT:
+        return ItemSnapshot.load(items_file)
+    if details is None:
+        raise ValueError("Invoice details are needed to select database items")
+    items = ItemDatabase.query(items_file, details)
+    if storage == "stream":
+        return items
+    if storage == "table":
+        return ItemTable(items)
+    return list(items)
+
+
+def snapshot_items(items_file, snapshot_file):
+    """
+    Converts a user supplied csv file of line items into a binary snapshot, which
+    later runs load in place of the csv file without parsing it (see ItemSnapshot).
+    The function returns a summary of the items converted.
+    """
+    count = ItemSnapshot.save(items_file, snapshot_file)
+    return f"{count} item(s) saved to {snapshot_file}"
+
+
+def import_items(items_file, database_file):
+    """
+    Appends the line items of a user supplied csv file to a SQLite timesheet
+    database, from which each invoice only selects the items of its period (see
+    ItemDatabase).  The function returns a summary of the items imported.
+    """
+    count = ItemDatabase.add(database_file, items_file)
+    return f"{count} item(s) imported into {database_file}"
+
+
+def run_batch(
+    manifest_file,
+    jobs=1,
+    storage=None,
+    validate_only=False,
+    incremental=False,
+    profile=None,
+    max_errors=None,
+    master_file=None,
+    spool_pages=False,
+):
+    """
+    Renders (or only validates the inputs of) every invoice listed in a manifest file.
+    Each line in the manifest is a json object naming a "details" file, an "items"
+    file and an optional "logo" image (relative paths are resolved against the
+    manifest's directory); instead of naming a details file, a line can hold the
+    invoice details themselves, so that an export of them in JSON Lines is a
+    manifest too (see Job).  Jobs naming no items file get the items of their
+    invoice period from the master items file, when one is given, which is only
+    parsed once for the whole run (see MasterTimesheet).  Invoices are rendered
+    within the current process, or spread across a pool of worker processes
+    when jobs is greater than one.
+    When incremental, only invoices whose inputs changed are rendered (see
+    build_invoice); when validating, up to max_errors errors are reported for each
+    invoice (see validate_invoice).  A failing job is reported and the run carries
+    on with the next one.  The function returns the number of failed jobs.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    options = dict(profile=profile, spool_pages=spool_pages)
+    action, outcome_label = partial(render_invoice, **options), "rendered"
+    if validate_only:
+        action = partial(validate_invoice, max_errors=max_errors)
+        outcome_label = "validated"
+    elif incremental:
+        action, outcome_label = partial(build_invoice, **options), "checked"
+    master = MasterTimesheet.load(master_file) if master_file else None
+    rendered = failed = 0
+    with (
+        ProcessPoolExecutor(jobs, initializer=None if validate_only else init_worker)
+        if jobs > 1
+        else nullcontext()
+    ) as pool:
+        outcomes = batch_outcomes(manifest_file, pool, storage, action, master)
+        if pool:
+            outcomes = list(outcomes)  # queue every job before waiting on results
+
+        for number, outcome in outcomes:
+            try:
+                result = outcome.result()
+                rendered += 1
+                print(f"line {number}: {result}")
+            except Exception as e:
+                failed += 1
+                print(f"line {number}: {e}", file=sys.stderr)
+
+    print(f"{rendered} invoice(s) {outcome_label}, {failed} failed", file=sys.stderr)
+    return failed
+
+
+def run_pipeline(
+    manifest_file, jobs=1, storage=None, profile=None, master_file=None, depth=4
+):
+    """
+    Renders every invoice listed in a manifest file (see run_batch), overlapping
+    the reading of each job's inputs and the writing of its PDF with rendering:
+    inputs are read ahead, and PDFs written, by up to depth threads each, while
+    invoices are rendered by jobs worker processes (see BatchPipeline).  This
+    pays off when inputs and outputs sit on high-latency (say, network) storage.
+    Outcomes are reported as jobs complete, rather than in manifest order.
+    The function returns the number of failed jobs.
+    """
+    import asyncio
+    from batch_pipeline import BatchPipeline
+    from concurrent.futures import ProcessPoolExecutor
+
+    base_dir = Path(manifest_file).parent
+    companies = {}
+    master = MasterTimesheet.load(master_file) if master_file else None
+    outcomes = {"rendered": 0, "failed": 0}
+
+    def read(line):
+        return read_job(Job.parse(line, base_dir, companies, master), storage, profile)
+
+    def report(number, outcome):
+        if isinstance(outcome, Exception):
+            outcomes["failed"] += 1
+            print(f"line {number}: {outcome}", file=sys.stderr)
+        else:
+            outcomes["rendered"] += 1
+            print(f"line {number}: {outcome}")
+
+    with ProcessPoolExecutor(jobs, initializer=init_worker) as pool:
+        pipeline = BatchPipeline(read, render_inputs, write_output, pool, jobs, depth)
+        asyncio.run(pipeline.run(Job.lines_from(manifest_file), report))
+
+    print(
+        f"{outcomes['rendered']} invoice(s) rendered, {outcomes['failed']} failed",
+        file=sys.stderr,
+    )
+    return outcomes["failed"]
+
+
+def read_job(job, storage=None, profile=None):
+    """
+    Reads the inputs of a batch job ahead of rendering it: the contents of its
+    details file and of its items file, unless they are held in a snapshot or a
+    database (which are read in place when rendering).  The function returns the
+    arguments of render_inputs.
+    """
+    details = job.details
+    if not isinstance(details, Details):
+        details = Path(details).read_bytes()
+    items = job.items
+    if not isinstance(items, ItemTable):
+        with open(items, "rb") as f:
+            if ItemFormat.of(f) == ItemFormat.CSV:
+                items = f.read()
+    return job.logo, details, items, storage, profile
+
+
+def render_inputs(logo_image, details, items, storage=None, profile=None):
+    """
+    Creates an invoice from inputs read ahead by read_job (the contents of its
+    details and items files, or what load_details and load_items accept) and
+    renders it, returning the name of its file along with the PDF document.
+    """
+    if isinstance(details, bytes):
+        details = Details(json.loads(details))
+    if isinstance(items, bytes):
+        items = Item.iter_lines(io.StringIO(items.decode(), newline=""))
+        items = ItemTable(items) if storage == "table" else list(items)
+    from invoice import Invoice
+
+    invoice = Invoice(logo_image, details, load_items(items, storage, details), profile)
+    return invoice.file_name, invoice.to_bytes()
+
+
+def write_output(file_name, document):
+    """
+    Writes a rendered PDF document, returning the name of its file.
+    """
+    Path(file_name).write_bytes(document)
+    return file_name
+
+
+def combine_invoices(
+    manifest_file, output, storage=None, profile=None, master_file=None
+):
+    """
+    Renders every invoice listed in a manifest file (see run_batch, also for the
+    master items file) into a single document, written to the given path or
+    binary stream.  Each invoice starts on a new page, with its own header,
+    footer and page numbering, while the fonts (and logos shared by several
+    invoices) are embedded once.  As the document cannot be written without
+    them, any failing job stops the run.  The function returns the number of
+    invoices combined.
+    """
+    from invoice import Invoice
+
+    base_dir = Path(manifest_file).parent
+    companies = {}
+    master = MasterTimesheet.load(master_file) if master_file else None
+    document = None
+    count = 0
+    for number, line in Job.lines_from(manifest_file):
+        try:
+            job = Job.parse(line, base_dir, companies, master)
+            details = load_details(job.details)
+            items = load_items(job.items, storage, details)
+        except ValueError as ve:
+            raise ValueError(f"line {number}: {ve}")
+        if document is None:
+            document = Invoice(job.logo, details, items, profile)
+        else:
+            document.append_invoice(job.logo, details, items)
+        count += 1
+    if document is None:
+        raise ValueError(f"No invoices listed in '{manifest_file}'")
+    document.print(output)
+    return count
+
+
+def batch_outcomes(manifest_file, pool=None, storage=None, action=None, master=None):
+    """
+    Yields a (line number, future) pair for every job listed in a manifest file.
+    Jobs are submitted to the given process pool, or rendered on the spot when
+    no pool is supplied; invalid jobs resolve to a failed future either way.
+    The action run for each job defaults to render_invoice.
+    """
+    from concurrent.futures import Future
+
+    action = action or render_invoice
+    base_dir = Path(manifest_file).parent
+    companies = {}
+    for number, line in Job.lines_from(manifest_file):
+        outcome = Future()
+        try:
+            job = Job.parse(line, base_dir, companies, master)
+            if pool:
+                outcome = pool.submit(action, job.logo, job.details, job.items, storage)
+            else:
+                outcome.set_result(action(job.logo, job.details, job.items, storage))
+        except Exception as e:
+            outcome.set_exception(e)
+        yield number, outcome
+
+
+def cache_fonts():
+    """
+    Parses the invoice fonts into the on-disk font cache (refreshing stale
+    entries), so that later runs load the parsed fonts instead of the font files.
+    """
+    from font_registry import FontCache
+    from invoice import Invoice
+
+    Invoice.preload_fonts()
+    print(f"Fonts cached under {FontCache.directory()}")
+
+
+def init_worker():
+    """
+    Prepares a batch worker process, parsing the invoice fonts once up-front
+    so that every invoice rendered by the worker shares them.
+    """
+    from invoice import Invoice
+
+    Invoice.preload_fonts()
+
+
+def validate_invoice(
+    logo_image, details_file, items_file, storage=None, jobs=1, max_errors=None
+):
+    """
+    Checks the details and every line item of an invoice, the way rendering it
+    would, but without loading the PDF library.  The logo image is expected to
+    have been checked already (by the argument parser, or the batch job).
+    Every error found (up to max_errors) is reported, with the line it is on; a
+    large items file is checked by up to jobs worker processes (see
+    InputValidator).  The function returns a summary of the items found, or
+    raises a ValueError listing the errors.
+    """
+    from input_validator import InputValidator
+
+    validator = InputValidator(max_errors)
+    validator.check_details(details_file)
+    if not validator.stopped:
+        validator.check_items(items_file, jobs)
+    if validator.errors:
+        raise ValueError(validator.report())
+    return f"{validator.items} item(s) valid"
+
+
+def render_invoice(
+    logo_image, details_file, items_file, storage=None, profile=None, spool_pages=False
+):
+    """
+    Creates and prints an invoice, returning the name of the generated file.
+    """
+    invoice = create_invoice(
+        logo_image, details_file, items_file, storage, profile, spool_pages
+    )
+    invoice.print()
+    return invoice.file_name
+
+
+def build_invoice(
+    logo_image,
+    details_file,
+    items_file,
+    storage=None,
+    output=None,
+    profile=None,
+    spool_pages=False,
+):
+    """
+    Renders an invoice only when it is out of date: when any of its inputs (details,
+    items, logo, fonts, output profile or the generator itself) changed since it
+    was last built, as recorded by the build manifest kept next to the PDF.  The
+    function returns the name of the PDF, along with why it was rebuilt or that it
+    was up to date.
+    """
+    from build_manifest import BuildManifest
+    from invoice import Invoice
+
+    pdf_file = output or Invoice.file_name_for(
+        load_details(details_file).invoice_number
+    )
+    manifest = BuildManifest.of(
+        pdf_file, logo_image, details_file, items_file, Invoice.font_files(), profile
+    )
+    reasons = manifest.changes()
+    if not reasons:
+        return f"{pdf_file} up to date"
+    invoice = create_invoice(
+        logo_image, details_file, items_file, storage, profile, spool_pages
+    )
+    invoice.print(pdf_file)
+    manifest.save()
+    return f"{pdf_file} rebuilt: {', '.join(reasons)}"
+
+
+def serve(host, port, jobs=1, max_requests=1, max_queue=16, logo_dir=None):
+    """
+    Runs an http server rendering invoices until interrupted (see InvoiceServer
+    for the request format).  Invoices are rendered by a pool of worker processes,
+    which parse the invoice fonts once and keep them for every request.  Requests
+    can only name logos held in logo_dir (and none without it).
+    """
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(jobs, initializer=init_worker) as pool:
+        try:
+            asyncio.run(run_server(host, port, pool, max_requests, max_queue, logo_dir))
+        except KeyboardInterrupt:
+            pass
+
+
+async def run_server(host, port, pool, max_requests=1, max_queue=16, logo_dir=None):
+    """
+    Listens for invoice requests on the given address, rendering them in the
+    given executor, until the server is cancelled.
+    """
+    from server import InvoiceServer
+
+    server = InvoiceServer(render_request, pool, max_requests, max_queue, logo_dir)
+    async with await server.start(host, port) as listener:
+        for socket in listener.sockets:
+            host, port = socket.getsockname()[:2]
+            print(f"Serving invoices on http://{host}:{port}/invoice", file=sys.stderr)
+        await listener.serve_forever()
+
+
+def render_request(details_data, items_text, logo_image=None):
+    """
+    Creates an invoice from the contents of an http request: the invoice details
+    as a json object and the line items as csv text.  The function returns the
+    rendered PDF document as bytes.
+    """
+    details = Details(details_data)
+    items = list(Item.iter_lines(io.StringIO(items_text, newline="")))
+    from invoice import Invoice
+
+    return Invoice(logo_image, details, items).to_bytes()
 
 
 if __name__ == "__main__":
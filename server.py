@@ -0,0 +1,201 @@
+import asyncio
+import json
+import sys
+from details import Details
+from http import HTTPStatus
+from logo_cache import LogoCache
+from pathlib import Path
+
+
+class Request:
+    def __init__(self, data, logo_dir=None):
+        self.__set_details(data)
+        self.__set_items(data)
+        self.__set_logo(data, logo_dir)
+
+    def __set_details(self, data):
+        try:
+            self.details = data["details"]
+        except KeyError:
+            raise ValueError("Missing request details")
+        if not isinstance(self.details, dict):
+            raise ValueError("Invalid request details: expected a json object")
+        errors = Details.errors_in(self.details)
+        if errors:
+            raise ValueError("; ".join(errors))
+
+    def __set_items(self, data):
+        try:
+            self.items = data["items"]
+        except KeyError:
+            raise ValueError("Missing request items")
+        if not isinstance(self.items, str):
+            raise ValueError("Invalid request items: expected csv text")
+
+    def __set_logo(self, data, logo_dir=None):
+        # logos are named relative to the server's logo directory, and must not
+        # resolve outside of it: requests cannot have other server files read
+        self.logo = None
+        logo = data.get("logo")
+        if not logo:
+            return
+        if logo_dir is None:
+            raise ValueError("Invalid request logo: this server has no logos")
+        if not isinstance(logo, str):
+            raise ValueError("Invalid request logo: expected an image name")
+        path = Path(logo_dir) / logo
+        if not path.resolve().is_relative_to(Path(logo_dir).resolve()):
+            raise ValueError(f"Invalid request logo: '{logo}' is not a logo image")
+        self.logo = str(path)
+
+    @classmethod
+    def parse(cls, body, logo_dir=None):
+        try:
+            data = json.loads(body)
+        except json.JSONDecodeError as de:
+            raise ValueError(f"Invalid request: {de.msg}")
+        except UnicodeDecodeError:
+            raise ValueError("Invalid request: expected utf-8 text")
+        if not isinstance(data, dict):
+            raise ValueError("Invalid request: expected a json object")
+        return Request(data, logo_dir)
+
+
+class HttpError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+class InvoiceServer:
+    PATH = "/invoice"
+    MAX_BODY = 32 * 1024 * 1024
+    READ_TIMEOUT = 30
+
+    def __init__(self, render, pool, max_requests=1, max_queue=16, logo_dir=None):
+        """
+        Serves invoices over http: a POST to /invoice with a json object holding
+        the invoice "details" (as in a details file), its "items" (csv text) and
+        an optional "logo" (name of an image in the server's logo directory, when
+        it has one) is answered with the rendered PDF.  Rendering is handed to
+        the given executor, at most max_requests at a time; up to max_queue more
+        requests wait for their turn, and any further ones are turned away with
+        a 503 response.
+        """
+        self.__render = render
+        self.__pool = pool
+        self.__max_queue = max_queue
+        self.__logo_dir = logo_dir
+        self.__slots = asyncio.Semaphore(max_requests)
+        self.__waiting = 0
+
+    async def start(self, host, port):
+        return await asyncio.start_server(self.__handle, host, port)
+
+    async def __handle(self, reader, writer):
+        try:
+            body = await asyncio.wait_for(
+                self.__read(reader), InvoiceServer.READ_TIMEOUT
+            )
+            status, content_type, content = (
+                HTTPStatus.OK,
+                "application/pdf",
+                await self.__respond(body),
+            )
+        except HttpError as e:
+            status, content_type, content = (
+                e.status,
+                "text/plain; charset=utf-8",
+                f"{e}\n".encode(),
+            )
+        except asyncio.TimeoutError:
+            status, content_type, content = (
+                HTTPStatus.REQUEST_TIMEOUT,
+                "text/plain; charset=utf-8",
+                b"Request timed out\n",
+            )
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+
+        headers = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(content)}",
+            "Connection: close",
+        ]
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            headers.append("Retry-After: 1")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1"))
+        writer.write(content)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def __read(self, reader):
+        request_line = await self.__read_line(reader, HTTPStatus.REQUEST_URI_TOO_LONG)
+        request_line = request_line.decode("latin-1").split()
+        if len(request_line) != 3:
+            raise HttpError(HTTPStatus.BAD_REQUEST)
+        method, path, _ = request_line
+        headers = {}
+        too_large = HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE
+        end_of_headers = (b"\r\n", b"\n", b"")
+        while (line := await self.__read_line(reader, too_large)) not in end_of_headers:
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if path.split("?")[0] != InvoiceServer.PATH:
+            raise HttpError(HTTPStatus.NOT_FOUND)
+        if method != "POST":
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED)
+        try:
+            length = int(headers["content-length"])
+        except (KeyError, ValueError):
+            raise HttpError(HTTPStatus.LENGTH_REQUIRED)
+        if length > InvoiceServer.MAX_BODY:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        return await reader.readexactly(length)
+
+    async def __read_line(self, reader, too_long):
+        # lines longer than the reader's limit are turned away with the given
+        # status, rather than dropping the connection without a response
+        try:
+            return await reader.readline()
+        except (ValueError, asyncio.LimitOverrunError):
+            raise HttpError(too_long)
+
+    async def __respond(self, body):
+        try:
+            request = Request.parse(body, self.__logo_dir)
+            if request.logo:
+                # libmagic reads the image: kept off the event loop
+                await asyncio.to_thread(LogoCache.check, request.logo)
+        except ValueError as ve:
+            raise HttpError(HTTPStatus.BAD_REQUEST, ve)
+
+        if self.__slots.locked() and self.__waiting >= self.__max_queue:
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, "Too many requests queued")
+        self.__waiting += 1
+        try:
+            await self.__slots.acquire()
+        finally:
+            self.__waiting -= 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.__pool,
+                self.__render,
+                request.details,
+                request.items,
+                request.logo,
+            )
+        except ValueError as ve:
+            raise HttpError(HTTPStatus.BAD_REQUEST, ve)
+        except Exception as e:
+            print(f"{type(e).__name__}: {e}", file=sys.stderr)
+            raise HttpError(HTTPStatus.INTERNAL_SERVER_ERROR)
+        finally:
+            self.__slots.release()
@@ -1,9 +1,47 @@
+import asyncio
 import csv
 import json
+from batch import Job
+from datetime import date, datetime, timezone
+from invoice import Invoice
+from input_validator import InputValidator
 from item import Item
-from project import load_items, parse_args, load_details, create_invoice
+from item_database import ItemDatabase
+from item_snapshot import ItemSnapshot
+from item_table import ItemTable
+from logo_cache import LogoCache
+from master_timesheet import MasterTimesheet
+from output_profile import OutputProfile
+from page_spool import PageSpool, SpooledContentStream
+from project import (
+    build_invoice,
+    combine_invoices,
+    compute_totals,
+    create_invoice,
+    load_details,
+    load_items,
+    parse_args,
+    parse_options,
+    render_request,
+    run_batch,
+    run_pipeline,
+    validate_invoice,
+)
 from details import Details
+from font_registry import FontCache
+from fpdf import FPDF, FontFace
+from fpdf.enums import TableCellFillMode
+from fpdf.syntax import PDFContentStream
+from fpdf.fonts import TTFFont
+from io import BytesIO
+from pathlib import Path
+from profiler import Profiler
+from concurrent.futures import ThreadPoolExecutor
+from server import InvoiceServer, Request
+import os
 import pytest
+import re
+import subprocess
 import sys
 
 TEST_DATA_DIR = "test/data"
@@ -11,6 +49,10 @@ JPG_LOGO = f"{TEST_DATA_DIR}/smp.jpg"
 PNG_LOGO = f"{TEST_DATA_DIR}/smp.png"
 DETAILS_FILE = f"{TEST_DATA_DIR}/details.json"
 ITEMS_FILE = f"{TEST_DATA_DIR}/items.csv"
+ITEMS_LONG_FILE = f"{TEST_DATA_DIR}/items_long.csv"
+PDF_TOKEN = re.compile(rb"\((?:\\.|[^\\)])*\)|[^\s()]+", re.S)
+PDF_OPERAND = re.compile(rb"\(.*\)|[-+\d.]+|/\w+", re.S)
+PAINTED_WITH = {b"f": (b"rg",), b"S": (b"RG", b"w", b"J"), b"Tj": (b"rg", b"Tf")}
 
 """
 parse_args tests
@@ -118,6 +160,43 @@ def test_parse_args_items_file_missing(monkeypatch, capsys):
     assert captured.err == "Invoice items file 'missing.csv' not found\n"
 
 
+def test_parse_args_cache_fonts(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["project.py", "--cache-fonts"])
+    logo, details, items = parse_args()
+    assert (logo, details, items) == (None, None, None)
+
+
+def test_parse_args_manifest_excludes_details(monkeypatch, capsys):
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["project.py", "-m", DETAILS_FILE, "-d", DETAILS_FILE],
+    )
+    with pytest.raises(SystemExit):
+        parse_args()
+
+    captured = capsys.readouterr()
+    assert "argument -m/--manifest: not allowed with -d/--details" in captured.err
+
+
+def test_parse_args_pipeline_excludes_stream(monkeypatch, capsys):
+    monkeypatch.setattr(
+        sys, "argv", ["project.py", "-m", DETAILS_FILE, "--pipeline", "--stream"]
+    )
+    with pytest.raises(SystemExit):
+        parse_args()
+
+    captured = capsys.readouterr()
+    assert "argument --pipeline: not allowed with --stream" in captured.err
+
+
+def test_parse_options_serve(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["project.py", "serve", "-p", "9000", "-j", "2"])
+    options = parse_options()
+    assert (options.command, options.port, options.jobs) == ("serve", 9000, 2)
+    assert options.max_requests == 2
+
+
 """
 load_details tests
 """
@@ -148,6 +227,24 @@ def test_load_details():
     assert details.invoice_tax_rate == 0.13
 
 
+def test_job_details_share_companies():
+    data = json.loads(Path(DETAILS_FILE).read_text())
+    companies = {}
+    jobs = [
+        Job.parse(
+            json.dumps(
+                dict(data, invoice=dict(data["invoice"], number=n), items=ITEMS_FILE)
+            ),
+            companies=companies,
+        )
+        for n in (1, 2)
+    ]
+    assert [job.details.invoice_number for job in jobs] == [1, 2]
+    assert jobs[0].details.company_name is jobs[1].details.company_name
+    with pytest.raises(ValueError, match="Missing invoice number"):
+        Job.parse(json.dumps(dict(data, invoice={"date": "x"}, items=ITEMS_FILE)))
+
+
 def test_details_missing_company_attributes(capsys):
     assert_missing_details(capsys, att="company.name", error="Missing company name")
     assert_missing_details(capsys, att="company.street", error="Missing company street")
@@ -222,6 +319,91 @@ def test_load_items():
     assert "Tested pipeline fixes, looked for leaks" == items[1].description
 
 
+def test_load_items_stream():
+    items = load_items(ITEMS_FILE, storage="stream")
+    assert len(items) == 5
+    assert [item.hours for item in items] == [5.0, 3.0, 7.5, 3.5, 2.0]
+    assert [item.data for item in items] == [
+        item.data for item in load_items(ITEMS_FILE)
+    ]
+
+
+def test_load_items_table():
+    items = load_items(ITEMS_FILE, storage="table")
+    assert len(items) == 5
+    assert items[1].date == "Feb 05, 2024"
+    assert items[1].hours == 3.0
+    assert items[1].description == "Tested pipeline fixes, looked for leaks"
+    assert items.total_hours == 21
+    assert list(items.data) == [item.data for item in load_items(ITEMS_FILE)]
+
+
+def test_item_table_encodes_descriptions():
+    items = ItemTable.load(f"{TEST_DATA_DIR}/items_long.csv")
+    assert len({id(item.description) for item in items}) == 1
+
+
+def test_item_table_slices_like_a_list():
+    items = Item.load_all(ITEMS_LONG_FILE)
+    table = ItemTable(items)
+    assert [item.data for item in table[10:20:3]] == [
+        item.data for item in items[10:20:3]
+    ]
+    assert table[-1].data == items[-1].data
+    assert isinstance(table[:5], ItemTable) and len(table[:5]) == 5
+    with pytest.raises(TypeError, match="Cannot append to a read-only ItemTable"):
+        table[:5].append(items[0])
+
+
+def test_load_items_snapshot(tmp_path):
+    snapshot_file = tmp_path / "items.snap"
+    assert ItemSnapshot.save(ITEMS_LONG_FILE, snapshot_file) == 65
+    items = load_items(snapshot_file)
+    expected = Item.load_all(ITEMS_LONG_FILE)
+    assert [item.data for item in items] == [item.data for item in expected]
+    assert list(items.data) == [item.data for item in expected]
+    assert items.total_hours == sum(item.hours for item in expected)
+
+    snapshot_file.write_bytes(snapshot_file.read_bytes()[:-1])
+    with pytest.raises(ValueError, match="items.snap': truncated"):
+        ItemSnapshot.load(snapshot_file)
+
+
+def test_load_items_database(tmp_path):
+    items_file = tmp_path / "items.csv"
+    items_file.write_text(
+        "Date,Hours,Description,Customer\n"
+        "2024-01-31,1,Before the period,Bowser\n"
+        "2024-02-29,2,Last day,Bowser\n"
+        "2024-02-01,3,First day,\n"
+        "2024-02-10,4,Other customer,Peach\n"
+    )
+    database_file = tmp_path / "items.db"
+    assert ItemDatabase.add(database_file, items_file) == 4
+    details = load_details(DETAILS_FILE)
+
+    items = load_items(database_file, "stream", details)
+    assert len(items) == 2
+    assert [item.description for item in items] == ["First day", "Last day"]
+    assert compute_totals(DETAILS_FILE, database_file).hours == 5.0
+
+    items_file.write_text("Date,Hours,Description\n2024-02-02,x,Bad\n")
+    with pytest.raises(ValueError, match="Invalid number of hours: 'x'"):
+        ItemDatabase.add(database_file, items_file)
+    assert len(load_items(database_file, details=details)) == 2
+
+
+def test_iter_file_is_lazy(tmp_path):
+    items_file = tmp_path / "items.csv"
+    items_file.write_text("Date,Hours,Description\n2024-02-01,1,Ok\nbad,1,Bad\n")
+    items = Item.iter_file(items_file)
+    assert next(items).description == "Ok"
+    with pytest.raises(ValueError) as pytest_error:
+        next(items)
+
+    assert pytest_error.value.args[0] == "Invalid item date 'bad'"
+
+
 def test_item_missing_date(capsys):
     assert_incomplete_item(capsys, att="Date", error="Missing item date")
 
@@ -289,6 +471,670 @@ def test_create_invoice():
     assert invoice.amount_due == 2373.0
 
 
+def test_create_invoice_stream():
+    invoice = create_invoice(None, DETAILS_FILE, ITEMS_FILE, storage="stream")
+    assert len(invoice) == 5
+    assert invoice.total_hours == 21
+    assert invoice.amount_due == 2373.0
+
+
+def test_create_invoice_table():
+    invoice = create_invoice(None, DETAILS_FILE, ITEMS_FILE, storage="table")
+    assert len(invoice) == 5
+    assert invoice.items[3].description == "Replaced faucet on Kamek's workshop"
+    assert invoice.total_hours == 21
+    assert invoice.amount_due == 2373.0
+
+
+def test_invoice_totals_are_memoised():
+    passes = []
+
+    class CountingItems(tuple):
+        def __iter__(self):
+            passes.append(1)
+            return super().__iter__()
+
+    invoice = create_invoice(None, DETAILS_FILE, ITEMS_FILE)
+    invoice.items = CountingItems(invoice.items)
+    assert invoice.summary_data[1][1] == "21.0"
+    assert (invoice.total_cost, invoice.tax_amount, invoice.amount_due) == (
+        2100.0,
+        273.0,
+        2373.0,
+    )
+    assert len(passes) == 1
+
+    invoice.items = invoice.items[:1]
+    assert invoice.total_hours == 5.0
+    assert invoice.amount_due == 565.0
+    with pytest.raises(AttributeError):
+        invoice.items.append(invoice.items[0])
+
+    table = ItemTable(load_items(ITEMS_FILE))
+    invoice.items = table
+    assert invoice.total_hours == 21.0
+    table.append(table[0])
+    assert len(invoice.items) == 5 and invoice.total_hours == 21.0
+    assert sum(item.hours for item in invoice.items) == 21.0
+
+
+def test_compute_totals():
+    totals = compute_totals(DETAILS_FILE, ITEMS_FILE)
+    assert totals.hours == 21
+    assert totals.cost == 2100.0
+    assert totals.tax_amount == 273.0
+    assert totals.amount_due == 2373.0
+
+
+def test_invoices_share_parsed_fonts():
+    first = create_invoice(None, DETAILS_FILE, ITEMS_FILE)
+    second = create_invoice(None, DETAILS_FILE, ITEMS_FILE)
+    for fontkey, font in first.fonts.items():
+        assert font.cw is second.fonts[fontkey].cw
+        assert font.ttfont is not second.fonts[fontkey].ttfont
+        assert font.subset is not second.fonts[fontkey].subset
+    assert first.fonts["courierprime"].cw is first.fonts["courierprimeB"].cw
+
+
+def test_invoices_embed_own_glyph_subsets():
+    data = json.loads(Path(DETAILS_FILE).read_text())
+    items = load_items(ITEMS_FILE)
+    first = Invoice(None, Details(data), items)
+    second = Invoice(
+        None,
+        Details(dict(data, invoice=dict(data["invoice"], description="Jazz"))),
+        items,
+    )
+    first.to_bytes()
+    second.to_bytes()
+
+    def glyphs_of(invoice):
+        subset = invoice.fonts["courierprimeboldB"].subset
+        return {
+            "".join(map(chr, glyph.unicode)) for glyph, _ in subset.items() if glyph
+        }
+
+    assert {"J", "z"} <= glyphs_of(second)
+    assert not {"J", "z"} & glyphs_of(first)
+    assert {"P", "b", "g"} <= glyphs_of(first) - glyphs_of(second)
+
+
+def test_invoices_share_processed_logo():
+    first = create_invoice(PNG_LOGO, DETAILS_FILE, ITEMS_FILE)
+    second = create_invoice(PNG_LOGO, DETAILS_FILE, ITEMS_FILE)
+    first.to_bytes()
+    second.to_bytes()
+    (name, logo), *others = first.image_cache.images.items()
+    assert not others
+    assert logo["w"] == round(15 / 25.4 * LogoCache.DPI)
+    assert logo["usages"] == 2
+    assert logo["data"] is second.image_cache.images[name]["data"]
+    assert LogoCache.is_supported(PNG_LOGO) and LogoCache.is_supported(JPG_LOGO)
+
+
+def test_logo_file_read_once(tmp_path, monkeypatch):
+    logo_file = tmp_path / "logo.png"
+    logo_file.write_bytes(Path(PNG_LOGO).read_bytes())
+    reads = []
+    read_bytes, open_file = Path.read_bytes, open
+
+    def counting_read_bytes(path):
+        if path == logo_file:
+            reads.append("decoded")
+        return read_bytes(path)
+
+    def counting_open(file, *args, **kwargs):
+        if str(file) == str(logo_file.resolve()):
+            reads.append("hashed")
+        return open_file(file, *args, **kwargs)
+
+    monkeypatch.setattr(Path, "read_bytes", counting_read_bytes)
+    monkeypatch.setattr("builtins.open", counting_open)
+    create_invoice(str(logo_file), DETAILS_FILE, ITEMS_LONG_FILE).to_bytes()
+    # decoded unless a copy of the image already was
+    assert reads in (["hashed"], ["hashed", "decoded"])
+    first_reads = list(reads)
+    create_invoice(str(logo_file), DETAILS_FILE, ITEMS_LONG_FILE).to_bytes()
+    assert reads == first_reads
+
+
+def test_invoice_to_bytes():
+    invoice = create_invoice(None, DETAILS_FILE, ITEMS_FILE)
+    pdf = invoice.to_bytes()
+    assert pdf.startswith(b"%PDF-")
+    assert invoice.page_no() == 2
+
+    stream = BytesIO()
+    invoice.print(stream)
+    assert stream.getvalue() == pdf
+
+
+def test_invoice_spool_pages(tmp_path):
+    documents = {}
+    for spool_pages in (False, True):
+        invoice = create_invoice(
+            PNG_LOGO, DETAILS_FILE, ITEMS_LONG_FILE, spool_pages=spool_pages
+        )
+        invoice.set_creation_date(datetime(2024, 3, 4, tzinfo=timezone.utc))
+        pdf_file = tmp_path / f"invoice-{spool_pages}.pdf"
+        invoice.print(pdf_file)
+        documents[spool_pages] = pdf_file.read_bytes()
+    *finished, last = invoice.pages.values()
+    assert len(finished) == 2
+    assert all(isinstance(page.contents, SpooledContentStream) for page in finished)
+    assert not isinstance(last.contents, SpooledContentStream)
+    with pytest.raises(ValueError, match="can only be output once"):
+        invoice.print(pdf_file)
+    assert pdf_file.read_bytes() == documents[True]  # not truncated by the failure
+    assert [file.name for file in tmp_path.iterdir() if file.suffix == ".tmp"] == []
+
+    assert documents[True] == documents[False]
+    previous_umask = os.umask(0o077)
+    try:
+        for spool_pages in (False, True):
+            pdf_file = tmp_path / f"private-{spool_pages}.pdf"
+            create_invoice(
+                None, DETAILS_FILE, ITEMS_FILE, spool_pages=spool_pages
+            ).print(pdf_file)
+            assert pdf_file.stat().st_mode & 0o777 == 0o600
+    finally:
+        os.umask(previous_umask)
+    startxref = int(documents[True].rsplit(b"startxref", 1)[1].split()[0])
+    assert documents[True][startxref:].startswith(b"xref")
+
+
+def test_page_spool_pins_fpdf_version():
+    from fpdf import FPDF_VERSION
+
+    requirement = re.search(
+        r"^fpdf2>=([\d.]+),<([\d.]+)$", Path("requirements.txt").read_text(), re.M
+    )
+    lowest, below = requirement.groups()
+    major, minor = PageSpool.FPDF_VERSIONS.split(".")[:2]
+    assert lowest.startswith(PageSpool.FPDF_VERSIONS)
+    assert below == f"{major}.{int(minor) + 1}"
+    assert FPDF_VERSION.startswith(PageSpool.FPDF_VERSIONS)
+
+
+def test_invoice_output_profiles():
+    sizes = {}
+    for profile in (None, "fast", "small"):
+        invoice = create_invoice(PNG_LOGO, DETAILS_FILE, ITEMS_FILE, profile=profile)
+        sizes[profile] = len(invoice.to_bytes())
+    assert sizes["small"] < sizes[None] < sizes["fast"]
+    assert PDFContentStream._COMPRESSION_LEVEL == -1
+    with pytest.raises(ValueError, match="Invalid output profile: 'tiny'"):
+        OutputProfile.named("tiny")
+
+
+def test_output_profiles_apply_per_thread():
+    from fpdf import image_parsing
+    from threading import Barrier
+
+    both_applied = Barrier(2)
+
+    def levels_within(name):
+        with OutputProfile.named(name).applied():
+            both_applied.wait(timeout=5)
+            levels = (
+                PDFContentStream._COMPRESSION_LEVEL,
+                image_parsing.SETTINGS.compression_level,
+            )
+            both_applied.wait(timeout=5)
+            return levels
+
+    with ThreadPoolExecutor(2) as pool:
+        fast, small = pool.map(levels_within, ("fast", "small"))
+    assert fast == (1, 1) and small == (9, 9)
+    assert image_parsing.SETTINGS.compression_level == -1
+    assert type(image_parsing.SETTINGS) is image_parsing.ImageSettings
+    assert PDFContentStream.__dict__["_COMPRESSION_LEVEL"] == -1
+
+    # fpdf2's own settings still apply outside of any profile
+    image_parsing.SETTINGS.compression_level = 0
+    try:
+        with OutputProfile.named("small").applied():
+            assert image_parsing.SETTINGS.compression_level == 9
+        assert image_parsing.SETTINGS.compression_level == 0
+    finally:
+        image_parsing.SETTINGS.compression_level = -1
+
+
+def test_profiler_records_stages():
+    Profiler.start()
+    try:
+        create_invoice(None, DETAILS_FILE, ITEMS_FILE).to_bytes()
+    finally:
+        stages = Profiler.stop()
+    names = [stage["stage"] for stage in stages]
+    assert names[:3] == ["load_details", "load_items", "register_fonts"]
+    assert "add_items" in names and names[-1] == "output"
+    assert all(stage["wall_seconds"] >= 0 for stage in stages)
+
+
+def test_timesheet_table_lays_out_like_table():
+    items = Item.load_all(ITEMS_LONG_FILE)
+    items.append(Item.of(date(2024, 3, 1), 1.0, "Wrapped description " * 12))
+    layouts = []
+    for add_items in (add_table_items, Invoice.add_items):
+        invoice = create_invoice(None, DETAILS_FILE, ITEMS_FILE)
+        invoice.items = items
+        invoice.add_page()
+        add_items(invoice)
+        pages = [painted(page.contents) for page in invoice.pages.values()]
+        layouts.append((pages, round(invoice.y, 2), invoice.l_margin))
+    assert len(layouts[0][0]) == 2
+    assert layouts[0] == layouts[1]
+
+
+def add_table_items(invoice):
+    # the timesheet as laid out with fpdf's generic table(), before TimesheetTable
+    invoice.ln(Invoice.SECTION_SPACING - 5)
+    invoice.set_draw_color(150, 150, 150)
+    invoice.set_line_width(0.3)
+    with invoice.table(
+        borders_layout="NO_HORIZONTAL_LINES",
+        cell_fill_color=(232, 251, 255),
+        cell_fill_mode=TableCellFillMode.ROWS,
+        col_widths=(25, 15, 90),
+        headings_style=FontFace(fill_color=(220, 220, 220)),
+        line_height=6,
+        text_align=("LEFT", "LEFT", "LEFT"),
+        width=190,
+    ) as table:
+        invoice.set_font("CourierPrimeBold", "B", 10)
+        table.row(cells=["Date", "Hours", "Description"])
+
+        invoice.set_font("CourierPrime", "", 9)
+        for data in invoice.items_data:
+            row = table.row()
+            for datum in data:
+                row.cell(datum, padding=[0, 0, 0, 3])
+
+        invoice.set_font("CourierPrimeBold", "B", 9)
+        row = table.row()
+        row.cell("Total Hours:", padding=[0, 0, 0, 3])
+        row.cell(f"{invoice.total_hours}", padding=[0, 0, 0, 3])
+        row.cell("")
+
+
+def painted(contents):
+    # what a page content stream paints: paths and text positions, along with
+    # the colours, line and font each of them is painted with, so that streams
+    # only differing by redundant state changes compare equal
+    marks, operands, saved = [], [], []
+    state = {b"rg": (b"0",) * 3, b"RG": (b"0",) * 3}
+    for token in PDF_TOKEN.findall(bytes(contents)):
+        if PDF_OPERAND.fullmatch(token):
+            operands.append(token)
+            continue
+        if token == b"q":
+            saved.append(dict(state))
+        elif token == b"Q":
+            state = saved.pop()
+        elif token in (b"re", b"m", b"l", b"Td"):
+            marks.append((token, *operands))
+        elif token in PAINTED_WITH:
+            marks.append((token, *operands, *map(state.get, PAINTED_WITH[token])))
+        elif token in (b"g", b"G"):
+            state[{b"g": b"rg", b"G": b"RG"}[token]] = tuple(operands) * 3
+        elif token not in (b"BT", b"ET"):
+            state[token] = tuple(operands)
+        operands = []
+    return marks
+
+
+def page_streams(pdf):
+    # the content streams of an uncompressed document's pages, in page order
+    streams = re.findall(rb"stream\n(.*?)\nendstream", pdf, re.S)
+    return [stream for stream in streams if stream.rstrip().endswith(b"ET Q")]
+
+
+def footer_text(invoice, contents):
+    # the text drawn in the footer font, which is the last one a page uses
+    font = invoice.fonts["courierprimeitalicI"]
+    characters = {
+        code: "".join(map(chr, glyph.unicode)) for glyph, code in font.subset.items()
+    }
+    footer = contents.rsplit(b"/F%d " % font.i, 1)[1]
+    text = b"".join(re.findall(rb"\(((?:\\.|[^\\)])*)\) Tj", footer, re.S))
+    text = re.sub(rb"\\(.)", lambda m: {b"r": b"\r", b"n": b"\n"}.get(m[1], m[1]), text)
+    return "".join(
+        characters[int.from_bytes(text[i : i + 2], "big")]
+        for i in range(0, len(text), 2)
+    )
+
+
+def test_validate_invoice_skips_fpdf():
+    script = (
+        "import sys, project;"
+        f"print(project.validate_invoice(None, {DETAILS_FILE!r}, {ITEMS_FILE!r}));"
+        "print('fpdf' in sys.modules, 'magic' in sys.modules)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    assert result.stdout == "5 item(s) valid\nFalse False\n"
+
+
+def test_validate_invoice_reports_every_error(tmp_path):
+    details_file = tmp_path / "details.json"
+    details_file.write_text(json.dumps({"company": {}, "invoice": {"unit_cost": "x"}}))
+    with pytest.raises(ValueError) as pytest_error:
+        validate_invoice(None, details_file, ITEMS_FILE)
+
+    errors = pytest_error.value.args[0].splitlines()
+    assert errors[0] == f"{details_file}: Missing company name"
+    assert f"{details_file}: Missing customer customer" in errors
+    assert errors[-2] == f"{details_file}: Invalid unit cost: 'x'"
+    assert errors[-1] == "15 error(s) in 5 item(s)"
+
+
+def test_validate_invoice_reports_item_lines(tmp_path):
+    items_file = tmp_path / "items.csv"
+    items_file.write_text(
+        'Date,Hours,Description\n2024-02-01,1,"Two\nlines"\n\nbad,x,\n'
+    )
+    with pytest.raises(ValueError) as pytest_error:
+        validate_invoice(None, DETAILS_FILE, items_file)
+
+    assert pytest_error.value.args[0].splitlines() == [
+        f"{items_file}:5: Invalid item date 'bad'",
+        f"{items_file}:5: Invalid number of hours: 'x'",
+        f"{items_file}:5: Missing item description",
+        "3 error(s) in 2 item(s)",
+    ]
+    with pytest.raises(ValueError) as pytest_error:
+        validate_invoice(None, DETAILS_FILE, items_file, max_errors=1)
+
+    assert pytest_error.value.args[0].endswith(
+        ":5: Invalid item date 'bad'\nstopped after 1 error(s)"
+    )
+
+
+def test_validate_invoice_in_chunks(tmp_path, monkeypatch):
+    items_file = tmp_path / "items.csv"
+    rows = ['2024-02-01,1,"Quoted ""text"",\nover two lines"'] * 300
+    rows[7] = rows[250] = "2024-02-30,1,Bad date"
+    items_file.write_text("Date,Hours,Description\n" + "\n".join(rows) + "\n")
+    monkeypatch.setattr(InputValidator, "CHUNK_SIZE", 1024)
+    monkeypatch.setattr(InputValidator, "BLOCK_SIZE", 100)
+
+    reports = []
+    for jobs in (1, 3):
+        with pytest.raises(ValueError) as pytest_error:
+            validate_invoice(None, DETAILS_FILE, items_file, jobs=jobs)
+        reports.append(pytest_error.value.args[0])
+
+    assert reports[0] == reports[1]
+    assert reports[1].splitlines() == [
+        f"{items_file}:16: Invalid item date '2024-02-30'",
+        f"{items_file}:501: Invalid item date '2024-02-30'",
+        "2 error(s) in 300 item(s)",
+    ]
+
+
+def test_build_invoice_skips_unchanged(tmp_path):
+    items_file = tmp_path / "items.csv"
+    items_file.write_text(Path(ITEMS_FILE).read_text())
+    pdf_file = tmp_path / "invoice.pdf"
+    build = lambda: build_invoice(None, DETAILS_FILE, items_file, output=pdf_file)
+
+    assert build() == f"{pdf_file} rebuilt: pdf missing"
+    assert build() == f"{pdf_file} up to date"
+    with open(items_file, "a") as f:
+        f.write("2024-01-31,1.5,Overtime\n")
+    assert build() == f"{pdf_file} rebuilt: items changed"
+    (tmp_path / "invoice.pdf.json").write_text("{")
+    assert build() == f"{pdf_file} rebuilt: unreadable build manifest"
+    assert build() == f"{pdf_file} up to date"
+
+
+"""
+font cache tests
+"""
+
+
+def test_font_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("INVOICER_FONT_CACHE", str(tmp_path / "cache"))
+    font_file = tmp_path / "Anta-Regular.ttf"
+    font_file.write_bytes(Path("fonts/Anta-Regular.ttf").read_bytes())
+    data = font_file.read_bytes()
+    assert FontCache.load(font_file, data, FPDF()) is None
+
+    parsed = TTFFont(FPDF(), font_file, "anta", "")
+    FontCache.save(font_file, parsed)
+    cached = FontCache.load(font_file, data, FPDF())
+    assert cached.name == parsed.name
+    assert cached.cw == parsed.cw
+    assert cached.cmap == parsed.cmap
+    assert cached.glyph_ids == parsed.glyph_ids
+    assert vars(cached.desc) == vars(parsed.desc)
+
+    other_file = tmp_path / "other" / font_file.name
+    other_file.parent.mkdir()
+    other_file.write_bytes(data)
+    FontCache.save(other_file, TTFFont(FPDF(), other_file, "anta", ""))
+    assert FontCache.load(font_file, data, FPDF()) is not None
+
+    os.utime(font_file, ns=(0, 0))
+    assert FontCache.load(font_file, data, FPDF()) is None
+
+
+"""
+run_batch tests
+"""
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_batch(tmp_path, capsys, jobs):
+    manifest = tmp_path / "jobs.jsonl"
+    entries = [
+        {
+            "details": os.path.abspath(DETAILS_FILE),
+            "items": os.path.abspath(ITEMS_FILE),
+        },
+        {"details": "missing.json", "items": os.path.abspath(ITEMS_FILE)},
+        {"items": os.path.abspath(ITEMS_FILE)},
+    ]
+    manifest.write_text(
+        "\n".join(json.dumps(entry) for entry in entries) + "\n\nnot json\n"
+    )
+
+    try:
+        assert run_batch(str(manifest), jobs) == 3
+    finally:
+        os.remove("invoice-25.pdf")
+
+    captured = capsys.readouterr()
+    assert captured.out == "line 1: invoice-25.pdf\n"
+    assert (
+        f"line 2: Invoice details file '{tmp_path}/missing.json' not found"
+        in captured.err
+    )
+    assert "line 3: Missing job details" in captured.err
+    assert "line 5: Invalid job: Expecting value" in captured.err
+    assert "1 invoice(s) rendered, 3 failed" in captured.err
+
+
+def test_run_pipeline(tmp_path, capsys, monkeypatch):
+    data = json.loads(Path(DETAILS_FILE).read_text())
+    entries = [
+        {
+            "details": os.path.abspath(DETAILS_FILE),
+            "items": os.path.abspath(ITEMS_FILE),
+        },
+        {"details": "missing.json", "items": os.path.abspath(ITEMS_FILE)},
+        dict(
+            data,
+            invoice=dict(data["invoice"], number=26),
+            items=os.path.abspath(ITEMS_LONG_FILE),
+        ),
+    ]
+    manifest = tmp_path / "jobs.jsonl"
+    manifest.write_text("\n".join(json.dumps(entry) for entry in entries) + "\n")
+    monkeypatch.chdir(tmp_path)
+
+    assert run_pipeline(str(manifest), jobs=2, depth=2) == 1
+    captured = capsys.readouterr()
+    assert sorted(captured.out.splitlines()) == [
+        "line 1: invoice-25.pdf",
+        "line 3: invoice-26.pdf",
+    ]
+    assert "line 2: Invoice details file" in captured.err
+    assert "2 invoice(s) rendered, 1 failed" in captured.err
+    assert (tmp_path / "invoice-26.pdf").read_bytes().startswith(b"%PDF")
+
+
+def test_run_batch_details_stream(tmp_path, capsys):
+    data = json.loads(Path(DETAILS_FILE).read_text())
+    records = [
+        dict(data, items=os.path.abspath(ITEMS_FILE)),
+        {"company": data["company"], "items": os.path.abspath(ITEMS_FILE)},
+    ]
+    manifest = tmp_path / "details.jsonl"
+    manifest.write_text("\n".join(json.dumps(record) for record in records) + "\n")
+
+    assert run_batch(str(manifest), validate_only=True) == 1
+    captured = capsys.readouterr()
+    assert captured.out == "line 1: 5 item(s) valid\n"
+    assert (
+        "line 2: Missing customer customer; Missing invoice invoice\n" in captured.err
+    )
+
+
+def test_run_batch_master_items(tmp_path, capsys):
+    master_file = tmp_path / "master.csv"
+    master_file.write_text(
+        "Date,Hours,Description,Customer\n"
+        "2024-02-29,2,Last day,Bowser\n"
+        "2024-03-01,1,After the period,Bowser\n"
+        "2024-02-10,4,Other customer,Peach\n"
+        "2024-02-01,3,First day,Bowser\n"
+        "2024-02-10,5,Any customer,\n"
+    )
+    data = json.loads(Path(DETAILS_FILE).read_text())
+    records = [data, dict(data, customer=dict(data["customer"], name="Toad"))]
+    manifest = tmp_path / "details.jsonl"
+    manifest.write_text("\n".join(json.dumps(record) for record in records) + "\n")
+
+    assert run_batch(str(manifest), validate_only=True, master_file=master_file) == 0
+    captured = capsys.readouterr()
+    assert captured.out == "line 1: 3 item(s) valid\nline 2: 1 item(s) valid\n"
+
+    master = MasterTimesheet.load(master_file)
+    database_file = tmp_path / "items.db"
+    ItemDatabase.add(database_file, master_file)
+    for record in records:
+        details = Details(record)
+        items = [item.data for item in master.items_for(details)]
+        assert items == [item.data for item in load_items(database_file, None, details)]
+    assert items == [["Feb 10, 2024", "5.0", "Any customer"]]
+
+
+def test_combine_invoices(tmp_path):
+    manifest = tmp_path / "jobs.jsonl"
+    entries = [
+        {
+            "details": os.path.abspath(DETAILS_FILE),
+            "items": os.path.abspath(ITEMS_FILE),
+        },
+        {
+            "details": os.path.abspath(DETAILS_FILE),
+            "items": os.path.abspath(ITEMS_LONG_FILE),
+            "logo": os.path.abspath(PNG_LOGO),
+        },
+    ]
+    manifest.write_text("\n".join(json.dumps(entry) for entry in entries) + "\n")
+    output = BytesIO()
+    assert combine_invoices(str(manifest), output) == 2
+
+    pdf = output.getvalue()
+    assert pdf.count(b"/Type /Page\n") == 5
+    assert pdf.count(b"/FontName /") == len(Invoice.FONTS)
+
+    details = load_details(DETAILS_FILE)
+    document = Invoice(None, details, load_items(ITEMS_FILE))
+    document.append_invoice(PNG_LOGO, details, load_items(ITEMS_LONG_FILE))
+    document.compress = False
+    pdf = document.to_bytes()
+    footers = [footer_text(document, contents) for contents in page_streams(pdf)]
+    assert [footer[footer.index("Page") :] for footer in footers] == [
+        "Page 1 of 2",
+        "Page 2 of 2",
+        "Page 1 of 3",
+        "Page 2 of 3",
+        "Page 3 of 3",
+    ]
+
+    invoice = create_invoice(None, DETAILS_FILE, ITEMS_FILE)
+    invoice.to_bytes()
+    with pytest.raises(ValueError, match="cannot be appended once laid out"):
+        invoice.append_invoice(None, load_details(DETAILS_FILE), [])
+
+    manifest.write_text(json.dumps({"items": ITEMS_FILE}) + "\n")
+    with pytest.raises(ValueError, match="line 1: Missing job details"):
+        combine_invoices(str(manifest), output)
+
+
+"""
+serve tests
+"""
+
+
+async def post_invoice(port, body, headers=b""):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        b"POST /invoice HTTP/1.1\r\n%sContent-Length: %d\r\n\r\n%s"
+        % (headers, len(body), body)
+    )
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), content
+
+
+def test_serve():
+    async def scenario():
+        with ThreadPoolExecutor(1) as pool:
+            server = InvoiceServer(render_request, pool, logo_dir=TEST_DATA_DIR)
+            async with await server.start("127.0.0.1", 0) as listener:
+                port = listener.sockets[0].getsockname()[1]
+                with open(DETAILS_FILE) as details, open(ITEMS_FILE) as items:
+                    request = {"details": json.load(details), "items": items.read()}
+                responses = []
+                for logo in (None, "smp.png", "../../project.py", "details.json"):
+                    request["logo"] = logo
+                    body = json.dumps(request).encode()
+                    responses.append(await post_invoice(port, body))
+                request["logo"] = None
+                details = {**request["details"], "company": "x"}
+                body = json.dumps({**request, "details": details}).encode()
+                wrong_shape = await post_invoice(port, body)
+                request["items"] = "Date,Hours,Description\n2024-02-01,1.0,\n"
+                invalid = await post_invoice(port, json.dumps(request).encode())
+                header = b"X-Padding: %s\r\n" % (b"x" * 70000)
+                too_large = await post_invoice(port, b"{}", header)
+                return responses, wrong_shape, invalid, too_large
+
+    responses, wrong_shape, invalid, too_large = asyncio.run(scenario())
+    (status, content), (logo_status, with_logo), outside, not_image = responses
+    assert status == logo_status == 200
+    assert content.startswith(b"%PDF-")
+    assert len(with_logo) > len(content)
+    assert outside == (
+        400,
+        b"Invalid request logo: '../../project.py' is not a logo image\n",
+    )
+    assert not_image == (400, b"Invalid image: expected a png or jpg\n")
+    assert wrong_shape == (400, b"Missing company company\n")
+    assert invalid == (400, b"Missing item description\n")
+    assert too_large == (431, b"Request Header Fields Too Large\n")
+    details = json.loads(Path(DETAILS_FILE).read_text())
+    with pytest.raises(ValueError, match="this server has no logos"):
+        Request({"details": details, "items": "", "logo": "smp.png"})
+
+
 def assert_missing_details(capsys, att, error):
     data = load_test_details(excluding=att)
     # with capsys.disabled():
@@ -0,0 +1,165 @@
+import itertools
+from fpdf import FontFace
+from fpdf.enums import TableCellStyle
+
+
+class TimesheetTable:
+    HEADINGS = ("Date", "Hours", "Description")
+    COL_WIDTHS = (25, 15, 90)
+    WIDTH = 190
+    LINE_HEIGHT = 6
+    PADDING = 3
+    HEADINGS_FONT = ("CourierPrimeBold", "B", 10)
+    ROWS_FONT = ("CourierPrime", "", 9)
+    TOTALS_FONT = ("CourierPrimeBold", "B", 9)
+    HEADINGS_FILL = (220, 220, 220)
+    ROWS_FILL = (232, 251, 255)
+    MAX_MEASURED = 4096
+
+    def __init__(self, pdf):
+        """
+        Lays out the "Detailed Timesheet" of an invoice: a fixed three-column table
+        drawn just like fpdf's table() with the NO_HORIZONTAL_LINES borders layout,
+        row filling and a heading repeated on every page.  Column geometry is
+        computed once, rows are drawn as they are read, and a cell's text is only
+        broken into lines when it does not fit its column.
+        """
+        self.__pdf = pdf
+        self.__left = (pdf.w - TimesheetTable.WIDTH) / 2
+        scale = TimesheetTable.WIDTH / sum(TimesheetTable.COL_WIDTHS)
+        self.__columns = []
+        x = self.__left
+        for col_width in TimesheetTable.COL_WIDTHS:
+            self.__columns.append((x, col_width * scale))
+            x += col_width * scale
+        self.__headings_fill = FontFace(
+            fill_color=TimesheetTable.HEADINGS_FILL
+        ).fill_color
+        self.__rows_fill = FontFace(fill_color=TimesheetTable.ROWS_FILL).fill_color
+        self.__measured = {}
+
+    def render(self, rows, totals):
+        pdf = self.__pdf
+        prev_l_margin = pdf.l_margin
+        pdf.l_margin = pdf.x = self.__left
+        try:
+            self.__render(rows, totals)
+        finally:
+            pdf.l_margin = prev_l_margin
+            pdf.x = pdf.l_margin
+
+    def __render(self, rows, totals):
+        pdf = self.__pdf
+        rows = iter(rows)
+        first = next(rows, None)
+        pdf.set_font(*TimesheetTable.HEADINGS_FONT)
+        headings_height = self.__height_of(TimesheetTable.HEADINGS, 0)
+        if first is None:
+            pdf.set_font(*TimesheetTable.TOTALS_FONT)
+        else:
+            pdf.set_font(*TimesheetTable.ROWS_FONT)
+        first_height = self.__height_of(first or totals, TimesheetTable.PADDING)
+        # like fpdf's table(), never leave the headings alone at the bottom of a page
+        self.__break_page_if_needed(headings_height + first_height)
+        self.__break_page_if_needed(headings_height)
+        self.__render_headings()
+
+        index = 0
+        if first is not None:
+            pdf.set_font(*TimesheetTable.ROWS_FONT)
+            for index, cells in enumerate(itertools.chain((first,), rows), 1):
+                self.__add_row(cells, index)
+        pdf.set_font(*TimesheetTable.TOTALS_FONT)
+        self.__add_row(totals, index + 1, last=True)
+
+    def __add_row(self, cells, index, last=False):
+        pdf = self.__pdf
+        height = self.__height_of(cells, TimesheetTable.PADDING)
+        if self.__break_page_if_needed(height):
+            if pdf.y + height > pdf.page_break_trigger:
+                raise ValueError(f"Timesheet row {index} is too high to fit on a page")
+            font = (pdf.font_family, pdf.font_style, pdf.font_size_pt)
+            self.__render_headings()
+            pdf.set_font(*font)
+        self.__render_row(cells, index, height, TimesheetTable.PADDING, last)
+
+    def __break_page_if_needed(self, height):
+        # as fpdf does on automatic page breaks, the row carries on at the same x
+        pdf = self.__pdf
+        if not pdf.will_page_break(height):
+            return False
+        x = pdf.x
+        pdf.add_page(same=True)
+        pdf.x = x
+        return True
+
+    def __render_headings(self):
+        self.__pdf.set_font(*TimesheetTable.HEADINGS_FONT)
+        height = self.__height_of(TimesheetTable.HEADINGS, 0)
+        self.__render_row(TimesheetTable.HEADINGS, 0, height, 0, False)
+
+    def __render_row(self, cells, index, height, padding, last):
+        pdf = self.__pdf
+        y = pdf.y
+        fill = (
+            self.__headings_fill
+            if index == 0
+            else self.__rows_fill if index % 2 else None
+        )
+        border = TableCellStyle(left=True, bottom=last, right=True, top=index <= 1)
+        for (x, width), text in zip(self.__columns, cells):
+            border.draw_cell_border(pdf, x, y, x + width, y + height, fill_color=fill)
+            if not text:
+                continue
+            if self.__fits(text, width, padding):
+                # single line: cell() offsets its text by c_margin, which a
+                # padded table cell replaces with its left padding
+                offset = padding - pdf.c_margin if padding else 0
+                pdf.set_xy(x + offset, y + (height - TimesheetTable.LINE_HEIGHT) / 2)
+                pdf.cell(width - offset, TimesheetTable.LINE_HEIGHT, text)
+            else:
+                pdf.set_xy(
+                    x, y + (height - self.__wrap(text, width, padding, True)) / 2
+                )
+                self.__wrap(text, width, padding)
+        pdf.set_y(y)
+        pdf.ln(height)
+
+    def __height_of(self, cells, padding):
+        height = 0
+        for (_, width), text in zip(self.__columns, cells):
+            if not text:
+                continue
+            if self.__fits(text, width, padding):
+                height = max(height, TimesheetTable.LINE_HEIGHT)
+            else:
+                height = max(height, self.__wrap(text, width, padding, True))
+        return height or TimesheetTable.LINE_HEIGHT
+
+    def __fits(self, text, width, padding):
+        pdf = self.__pdf
+        key = (pdf.font_family, pdf.font_style, pdf.font_size_pt, width, padding, text)
+        fits = self.__measured.get(key)
+        if fits is None:
+            if len(self.__measured) >= TimesheetTable.MAX_MEASURED:
+                self.__measured.clear()  # keeps memory bounded on streamed items
+            margins = pdf.c_margin if padding else 2 * pdf.c_margin
+            fits = "\n" not in text and (
+                pdf.get_string_width(text) + margins <= width - padding
+            )
+            self.__measured[key] = fits
+        return fits
+
+    def __wrap(self, text, width, padding, dry_run=False):
+        return self.__pdf.multi_cell(
+            w=width,
+            h=TimesheetTable.LINE_HEIGHT,
+            text=text,
+            max_line_height=TimesheetTable.LINE_HEIGHT,
+            align="LEFT",
+            new_x="RIGHT",
+            new_y="TOP",
+            dry_run=dry_run,
+            output="HEIGHT",
+            padding=(0, 0, 0, padding),
+        )
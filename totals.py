@@ -0,0 +1,22 @@
+import functools
+from item_table import ItemTable
+
+
+class Totals:
+    def __init__(self, items, unit_cost, tax_rate=None):
+        self.hours = Totals.__hours_of(items)
+        self.unit_cost = unit_cost
+        self.cost = self.hours * unit_cost
+        self.tax_rate = tax_rate if tax_rate else 0
+        self.tax_amount = round(self.cost * self.tax_rate, 2)
+        self.amount_due = round(self.cost + self.tax_amount, 2)
+
+    @classmethod
+    def __hours_of(cls, items):
+        if isinstance(items, ItemTable):
+            return items.total_hours
+        return functools.reduce(lambda total, item: total + item.hours, items, 0)
+
+    @classmethod
+    def of(cls, details, items):
+        return Totals(items, details.invoice_unit_cost, details.invoice_tax_rate)